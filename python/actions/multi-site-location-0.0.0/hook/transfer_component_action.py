@@ -1,19 +1,55 @@
 # :coding: utf-8
 # :copyright: Copyright (c) 2019 ftrack
 
+import os
 import json
 import sys
+import time
+import hashlib
 import argparse
 import logging
 import threading
 import collections
+import concurrent.futures
 
 import ftrack_api
 import ftrack_api.exception
+import ftrack_api.accessor.disk
+import ftrack_api.entity.component
 import ftrack_action_handler.action
 
 SUPPORTED_ENTITY_TYPES = ('AssetVersion', 'TypedContext', 'Project', 'Component')
 
+#: Number of components transferred concurrently.
+TRANSFER_WORKERS = int(os.environ.get('FTRACK_TRANSFER_WORKERS', 4))
+
+#: Number of attempts made for each component before giving up.
+TRANSFER_ATTEMPTS = int(os.environ.get('FTRACK_TRANSFER_ATTEMPTS', 3))
+
+#: Seconds to wait before retrying a component, multiplied by the attempt.
+TRANSFER_RETRY_DELAY = float(os.environ.get('FTRACK_TRANSFER_RETRY_DELAY', 5))
+
+#: Minimum number of seconds between two job progress updates.
+PROGRESS_INTERVAL = float(os.environ.get('FTRACK_TRANSFER_PROGRESS_INTERVAL', 5))
+
+#: Directory holding the transfer manifests, one per location pair.
+MANIFEST_DIRECTORY = os.environ.get(
+    'FTRACK_TRANSFER_MANIFEST_DIRECTORY',
+    os.path.join(os.path.expanduser('~'), '.ftrack', 'transfer_manifests'),
+)
+
+#: Hash transferred files again to record their content hash in the manifest.
+VERIFY_TRANSFERS = os.environ.get('FTRACK_TRANSFER_VERIFY') == '1'
+
+#: Size of the chunks read when hashing files.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+#: Number of components fetched per discovery query page.
+DISCOVERY_PAGE_SIZE = int(os.environ.get('FTRACK_TRANSFER_PAGE_SIZE', 500))
+
+#: Attributes projected when discovering components.
+DISCOVERY_ATTRIBUTES = ('id', 'name', 'file_type', 'size', 'container_id')
+
 
 def _async(fn):
     '''Run *fn* asynchronously.'''
@@ -30,6 +66,364 @@ def get_filter_string(entity_ids):
     return ', '.join('"{0}"'.format(entity_id) for entity_id in entity_ids)
 
 
+def get_file_hash(path):
+    '''Return sha1 hex digest of the file at *path*.'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_object:
+        for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def get_disk_path(location, component):
+    '''Return filesystem path of *component* in *location* or None.
+
+    Only single file components stored through a
+    :class:`ftrack_api.accessor.disk.DiskAccessor` have a path.
+
+    '''
+    if isinstance(component, ftrack_api.entity.component.ContainerComponent):
+        return None
+
+    if not isinstance(location.accessor, ftrack_api.accessor.disk.DiskAccessor):
+        return None
+
+    try:
+        return location.get_filesystem_path(component)
+    except ftrack_api.exception.LocationError:
+        return None
+
+
+class TransferManifest(object):
+    '''Append-only journal of component transfers between two locations.
+
+    Each line is a JSON record holding the component id, size, content hash
+    and final state. When a component appears more than once, the last
+    record wins, so an interrupted transfer can be resumed by skipping the
+    components already in a completed state.
+
+    '''
+
+    #: States for which the component does not need to be transferred again.
+    COMPLETED_STATES = ('transferred', 'present')
+
+    def __init__(self, path):
+        '''Initialise manifest stored at *path*, loading existing records.'''
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if os.path.isfile(self.path):
+            with open(self.path) as file_object:
+                for line in file_object:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partially written line from an interrupted run.
+                        continue
+
+                    self.records[record['id']] = record
+
+    @classmethod
+    def for_locations(cls, source_location_id, target_location_id):
+        '''Return manifest for transfers between the two location ids.'''
+        if not os.path.isdir(MANIFEST_DIRECTORY):
+            os.makedirs(MANIFEST_DIRECTORY)
+
+        return cls(
+            os.path.join(
+                MANIFEST_DIRECTORY,
+                '{0}_{1}.jsonl'.format(source_location_id, target_location_id),
+            )
+        )
+
+    def is_completed(self, component_id):
+        '''Return whether *component_id* was already transferred.'''
+        record = self.records.get(component_id)
+        return record is not None and record['state'] in self.COMPLETED_STATES
+
+    def record(self, component_id, size, content_hash, state):
+        '''Append record for *component_id* to the journal.'''
+        record = {
+            'id': component_id,
+            'size': size,
+            'hash': content_hash,
+            'state': state,
+            'time': time.time(),
+        }
+        line = json.dumps(record) + '\n'
+
+        with self._lock:
+            with open(self.path, 'a') as file_object:
+                file_object.write(line)
+                file_object.flush()
+                os.fsync(file_object.fileno())
+
+            self.records[component_id] = record
+
+
+class JobProgress(object):
+    '''Report transfer progress on *job*, at most once every *interval*.'''
+
+    def __init__(self, session, job, interval=PROGRESS_INTERVAL):
+        '''Initialise with *session* owning *job*.'''
+        self.session = session
+        self.job = job
+        self.interval = interval
+        self._last_update = None
+
+    def update(self, index, amount, force=False, gathering=False):
+        '''Update job description with *index* of *amount*.
+
+        Updates falling within *interval* of the previous one are dropped
+        unless *force* is True. If *gathering*, *amount* is only the number
+        of components discovered so far.
+
+        '''
+        now = time.time()
+        if (
+            not force
+            and self._last_update is not None
+            and now - self._last_update < self.interval
+        ):
+            return
+
+        self._last_update = now
+        description = 'Transfer components ({0} of {1})'.format(index, amount)
+        if gathering:
+            description = 'Transfer components ({0} of {1}, gathering...)'.format(
+                index, amount
+            )
+
+        self.job['data'] = json.dumps({'description': description})
+        self.session.commit()
+
+
+class ComponentTransferWorker(object):
+    '''Transfer single components, using one session per thread.
+
+    Sessions are not thread safe, so each pool thread lazily creates its own
+    session and re-fetches the locations in it. Call :meth:`close` once the
+    pool has been shut down.
+
+    '''
+
+    def __init__(
+        self,
+        source_location_id,
+        target_location_id,
+        ignore_component_not_in_location=False,
+        ignore_location_errors=False,
+        manifest=None,
+        attempts=TRANSFER_ATTEMPTS,
+        retry_delay=TRANSFER_RETRY_DELAY,
+        logger=None,
+    ):
+        '''Initialise worker for *source_location_id* to *target_location_id*.'''
+        self.source_location_id = source_location_id
+        self.target_location_id = target_location_id
+        self.ignore_component_not_in_location = ignore_component_not_in_location
+        self.ignore_location_errors = ignore_location_errors
+        self.manifest = manifest
+        self.attempts = max(1, attempts)
+        self.retry_delay = retry_delay
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        '''Return session bound to the calling thread.'''
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = ftrack_api.Session(auto_connect_event_hub=False)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+
+        return session
+
+    def __call__(self, component_id):
+        '''Transfer component with *component_id* and return its state.
+
+        The returned state is one of *transferred*, *present* when the
+        component already is in the target location, *missing* when it is not
+        in the source location or *failed*. Location errors are retried up to
+        *attempts* times before being raised, or logged if errors are ignored.
+
+        '''
+        session = self._get_session()
+        component = session.get('Component', component_id)
+        source_location = session.get('Location', self.source_location_id)
+        target_location = session.get('Location', self.target_location_id)
+
+        try:
+            registered, content_hash = self._register_identical(
+                session, component, source_location, target_location
+            )
+            if registered:
+                state = 'present'
+            else:
+                state = self._add_component(
+                    session, component, source_location, target_location
+                )
+        except BaseException:
+            self._record(component, target_location, 'failed')
+            raise
+
+        self._record(component, target_location, state, content_hash)
+        return state
+
+    def _add_component(self, session, component, source_location, target_location):
+        '''Add *component* to *target_location* and return its state.'''
+        for attempt in range(1, self.attempts + 1):
+            try:
+                target_location.add_component(component, source=source_location)
+            except ftrack_api.exception.ComponentInLocationError:
+                self.logger.info(
+                    'Component ({}) already in target location'.format(component)
+                )
+                return 'present'
+            except ftrack_api.exception.ComponentNotInLocationError:
+                if (
+                    self.ignore_component_not_in_location
+                    or self.ignore_location_errors
+                ):
+                    self.logger.exception('Failed to add component to location')
+                    return 'missing'
+
+                raise
+            except ftrack_api.exception.LocationError:
+                session.rollback()
+                if attempt < self.attempts:
+                    self.logger.warning(
+                        'Failed to add component ({0}) to location, retrying '
+                        '({1} of {2})'.format(component, attempt, self.attempts),
+                        exc_info=True,
+                    )
+                    time.sleep(self.retry_delay * attempt)
+                    continue
+
+                if self.ignore_location_errors:
+                    self.logger.exception('Failed to add component to location')
+                    return 'failed'
+
+                raise
+
+            # Keep the source modification time on the copy, so the next
+            # identical check can be answered without hashing.
+            source_path = get_disk_path(source_location, component)
+            target_path = get_disk_path(target_location, component)
+            if source_path and target_path:
+                source_stat = os.stat(source_path)
+                os.utime(target_path, (source_stat.st_atime, source_stat.st_mtime))
+
+            return 'transferred'
+
+    def _register_identical(
+        self, session, component, source_location, target_location
+    ):
+        '''Register *component* in *target_location* if already on disk.
+
+        A file already at the target prefix is considered byte identical when
+        size and modification time match the source, or failing that when
+        their content hashes match. Return whether the component is in
+        *target_location*, with the content hash of the file if it was
+        computed for the comparison.
+
+        '''
+        if target_location.get_component_availability(component) == 100.0:
+            self.logger.info(
+                'Component ({}) already in target location'.format(component)
+            )
+            return True, None
+
+        source_path = get_disk_path(source_location, component)
+        if not source_path or not os.path.isfile(source_path):
+            return False, None
+
+        if not isinstance(
+            target_location.accessor, ftrack_api.accessor.disk.DiskAccessor
+        ):
+            return False, None
+
+        try:
+            resource_identifier = target_location.structure.get_resource_identifier(
+                component
+            )
+        except ftrack_api.exception.StructureError:
+            return False, None
+
+        target_path = target_location.accessor.get_filesystem_path(
+            resource_identifier
+        )
+        if not os.path.isfile(target_path):
+            return False, None
+
+        source_stat = os.stat(source_path)
+        target_stat = os.stat(target_path)
+        if source_stat.st_size != target_stat.st_size:
+            return False, None
+
+        content_hash = None
+        if int(source_stat.st_mtime) != int(target_stat.st_mtime):
+            content_hash = get_file_hash(target_path)
+            if get_file_hash(source_path) != content_hash:
+                return False, None
+
+        try:
+            target_location._register_component_in_location(
+                component, resource_identifier
+            )
+        except ftrack_api.exception.ServerError:
+            # Registered concurrently, leave it to the regular transfer to
+            # report the component as already in the target location.
+            session.rollback()
+            self.logger.warning(
+                'Failed to register component ({0}) found on disk at '
+                '{1}'.format(component, target_path),
+                exc_info=True,
+            )
+            return False, None
+
+        self.logger.info(
+            'Component ({0}) already on disk at {1}'.format(component, target_path)
+        )
+        return True, content_hash
+
+    def _record(self, component, target_location, state, content_hash=None):
+        '''Record *state* of *component* in the manifest, if any.
+
+        *content_hash* is recorded when already known. Otherwise the file in
+        *target_location* is only hashed when :data:`VERIFY_TRANSFERS` is
+        set, as reading back every file doubles the IO of a transfer.
+
+        '''
+        if self.manifest is None:
+            return
+
+        if (
+            content_hash is None
+            and VERIFY_TRANSFERS
+            and state in TransferManifest.COMPLETED_STATES
+        ):
+            target_path = get_disk_path(target_location, component)
+            if target_path and os.path.isfile(target_path):
+                content_hash = get_file_hash(target_path)
+
+        self.manifest.record(component['id'], component['size'], content_hash, state)
+
+    def close(self):
+        '''Close all sessions created by this worker.'''
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+
+        for session in sessions:
+            session.close()
+
+
 class TransferComponentsAction(ftrack_action_handler.action.BaseAction):
     '''Action to transfer components between locations.'''
 
@@ -61,55 +455,96 @@ class TransferComponentsAction(ftrack_action_handler.action.BaseAction):
         self.logger.info('Discovering action with entities: {0}'.format(entities))
         return self.validate_entities(entities)
 
-    def get_components_in_location(self, session, entities, location):
-        '''Return list of components in *entities*.'''
-        component_queries = []
+    def get_components_in_location(
+        self, session, entities, location, page_size=DISCOVERY_PAGE_SIZE
+    ):
+        '''Yield pages of components in *entities* and *location*.
+
+        Components are gathered with a single query, paged by *page_size* and
+        projected to :data:`DISCOVERY_ATTRIBUTES`. Each page is a list of
+        dictionaries, and *session* is reset between pages so that memory does
+        not grow with the selection. Use a dedicated *session*.
+
+        '''
         entity_groups = collections.defaultdict(list)
         for entity_type, entity_id in entities:
             entity_groups[entity_type].append(entity_id)
 
+        criteria = []
         if entity_groups['Project']:
-            component_queries.append(
-                'Component where (version.asset.parent.project.id in ({0}) or '
-                'version.asset.parent.id in ({0}))'.format(
+            criteria.append(
+                'version.asset.parent.project.id in ({0}) or '
+                'version.asset.parent.id in ({0})'.format(
                     get_filter_string(entity_groups['Project'])
                 )
             )
 
         if entity_groups['TypedContext']:
-            component_queries.append(
-                'Component where (version.asset.parent.ancestors.id in ({0}) or '
-                'version.asset.parent.id in ({0}))'.format(
+            criteria.append(
+                'version.asset.parent.ancestors.id in ({0}) or '
+                'version.asset.parent.id in ({0})'.format(
                     get_filter_string(entity_groups['TypedContext'])
                 )
             )
 
         if entity_groups['AssetVersion']:
-            component_queries.append(
-                'Component where version_id in ({0})'.format(
+            criteria.append(
+                'version_id in ({0})'.format(
                     get_filter_string(entity_groups['AssetVersion'])
                 )
             )
 
         if entity_groups['Component']:
-            component_queries.append(
-                'Component where id in ({0})'.format(
-                    get_filter_string(entity_groups['Component'])
-                )
+            criteria.append(
+                'id in ({0})'.format(get_filter_string(entity_groups['Component']))
             )
 
-        components = set()
-        for query_string in component_queries:
-            components.update(
-                session.query(
-                    '{0} and component_locations.location_id is "{1}"'.format(
-                        query_string, location['id']
-                    )
-                ).all()
+        if not criteria:
+            return
+
+        query_string = (
+            'select {0} from Component where ({1}) and '
+            'component_locations.location_id is "{2}" order by id'.format(
+                ', '.join(DISCOVERY_ATTRIBUTES),
+                ' or '.join('({0})'.format(criterion) for criterion in criteria),
+                location['id'],
             )
+        )
+
+        offset = 0
+        while True:
+            page = [
+                {attribute: component[attribute] for attribute in DISCOVERY_ATTRIBUTES}
+                for component in session.query(
+                    '{0} offset {1} limit {2}'.format(query_string, offset, page_size)
+                )
+            ]
+            session.reset()
+
+            if not page:
+                break
+
+            offset += len(page)
+            self.logger.debug('Found {0} components in selection'.format(offset))
+            yield page
+
+            if len(page) < page_size:
+                break
+
+        self.logger.info('Found {0} components in selection'.format(offset))
+
+    def _wait_for_transfers(self, futures, return_when):
+        '''Wait on *futures* as per *return_when* and return finished count.
 
-        self.logger.info('Found {0} components in selection'.format(len(components)))
-        return list(components)
+        Finished futures are removed from *futures* and their errors raised.
+
+        '''
+        done, _ = concurrent.futures.wait(futures, return_when=return_when)
+        for future in done:
+            futures.discard(future)
+            future.result()
+
+        return len(done)
 
     @_async
     def transfer_components(
@@ -144,41 +579,86 @@ class TransferComponentsAction(ftrack_action_handler.action.BaseAction):
         )
         session.commit()
         try:
-            components = self.get_components_in_location(
-                session, entities, source_location
+            manifest = TransferManifest.for_locations(
+                source_location['id'], target_location['id']
+            )
+            progress = JobProgress(session, job)
+            worker = ComponentTransferWorker(
+                source_location['id'],
+                target_location['id'],
+                ignore_component_not_in_location=ignore_component_not_in_location,
+                ignore_location_errors=ignore_location_errors,
+                manifest=manifest,
+                logger=self.logger,
+            )
+            discovery_session = ftrack_api.Session(auto_connect_event_hub=False)
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=TRANSFER_WORKERS
             )
-            amount = len(components)
-            self.logger.info('Transferring {0} components'.format(amount))
 
-            for index, component in enumerate(components, start=1):
-                self.logger.info(
-                    'Transferring component ({0} of {1})'.format(index, amount)
-                )
-                job['data'] = json.dumps(
-                    {
-                        'description': 'Transfer components ({0} of {1})'.format(
-                            index, amount
-                        )
-                    }
-                )
-                session.commit()
+            # Transfers start as soon as the first page is discovered. At most
+            # one page worth of components is queued at any time, which keeps
+            # memory flat and throttles discovery to the transfer speed.
+            max_pending = max(DISCOVERY_PAGE_SIZE, TRANSFER_WORKERS)
+            futures = set()
+            amount = 0
+            skipped = 0
+            transferred = 0
+            try:
+                for page in self.get_components_in_location(
+                    discovery_session, entities, source_location
+                ):
+                    components = [
+                        component
+                        for component in page
+                        if not manifest.is_completed(component['id'])
+                    ]
+                    skipped += len(page) - len(components)
+
+                    # Largest components first, so that the pool does not end
+                    # up waiting on a single big file at the end of a page.
+                    components.sort(
+                        key=lambda component: component['size'] or 0, reverse=True
+                    )
+                    for component in components:
+                        while len(futures) >= max_pending:
+                            transferred += self._wait_for_transfers(
+                                futures, concurrent.futures.FIRST_COMPLETED
+                            )
+                            progress.update(transferred, amount, gathering=True)
+
+                        futures.add(executor.submit(worker, component['id']))
+                        amount += 1
 
-                try:
-                    target_location.add_component(component, source=source_location)
-                except ftrack_api.exception.ComponentInLocationError:
+                    progress.update(transferred, amount, gathering=True)
+
+                if skipped:
                     self.logger.info(
-                        'Component ({}) already in target location'.format(component)
+                        'Skipped {0} components already transferred according '
+                        'to {1}'.format(skipped, manifest.path)
+                    )
+
+                self.logger.info(
+                    'Transferring {0} components using {1} workers'.format(
+                        amount, TRANSFER_WORKERS
+                    )
+                )
+                while futures:
+                    transferred += self._wait_for_transfers(
+                        futures, concurrent.futures.FIRST_COMPLETED
                     )
-                except ftrack_api.exception.ComponentNotInLocationError:
-                    if ignore_component_not_in_location or ignore_location_errors:
-                        self.logger.exception('Failed to add component to location')
-                    else:
-                        raise
-                except ftrack_api.exception.LocationError:
-                    if ignore_location_errors:
-                        self.logger.exception('Failed to add component to location')
-                    else:
-                        raise
+                    progress.update(transferred, amount)
+
+                progress.update(transferred, amount, force=True)
+
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                executor.shutdown(wait=True)
+                worker.close()
+                discovery_session.close()
 
             job['status'] = 'done'
             session.commit()
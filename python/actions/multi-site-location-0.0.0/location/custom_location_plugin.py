@@ -3,10 +3,18 @@
 
 import os
 import sys
+import errno
 import functools
 import logging
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on windows, reflinks are not supported there.
+    fcntl = None
+
 import ftrack_api
+import ftrack_api.exception
 import ftrack_api.accessor.disk
 import ftrack_api.structure.standard
 
@@ -17,6 +25,210 @@ logger = logging.getLogger(
 # retrieve current location from the environment variables
 current_location = os.environ.get('FTRACK_LOCATION')
 
+# Strategies tried in order when copying between disk locations.
+copy_strategies = [
+    strategy.strip()
+    for strategy in os.environ.get(
+        'FTRACK_TRANSFER_COPY_STRATEGIES',
+        'copy_file_range,sendfile,reflink,hardlink,buffered',
+    ).split(',')
+    if strategy.strip()
+]
+
+# Hard links share data between both locations, so only use them on request.
+allow_hardlinks = os.environ.get('FTRACK_TRANSFER_HARDLINK') == '1'
+
+# Size of the buffer used by the buffered copy, a multiple of the page size.
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# ioctl request number cloning a file on linux (FICLONE).
+FICLONE = 0x40049409
+
+# Errors meaning a strategy is not supported for the given files.
+UNSUPPORTED_ERRORS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EPERM,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+)
+
+
+class CopyStrategyUnsupported(Exception):
+    '''Raise when a copy strategy can not be used for a pair of files.'''
+
+
+def _same_filesystem(source_path, target_path):
+    '''Return whether *source_path* and *target_path* share a filesystem.'''
+    return (
+        os.stat(source_path).st_dev
+        == os.stat(os.path.dirname(target_path)).st_dev
+    )
+
+
+def _copy_file_range(source_path, target_path):
+    '''Copy *source_path* to *target_path* in kernel with copy_file_range.'''
+    if not hasattr(os, 'copy_file_range'):
+        raise CopyStrategyUnsupported()
+
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        remaining = os.fstat(source.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(
+                source.fileno(), target.fileno(), min(remaining, 1 << 30)
+            )
+            if copied == 0:
+                # Some filesystems (FUSE, NFS, overlay) report no data copied
+                # rather than failing, fall back instead of truncating.
+                raise CopyStrategyUnsupported()
+            remaining -= copied
+
+
+def _sendfile(source_path, target_path):
+    '''Copy *source_path* to *target_path* in kernel with sendfile.'''
+    if not hasattr(os, 'sendfile') or sys.platform != 'linux':
+        # Only linux supports regular files as sendfile target.
+        raise CopyStrategyUnsupported()
+
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        size = os.fstat(source.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(
+                target.fileno(), source.fileno(), offset, min(size - offset, 1 << 30)
+            )
+            if sent == 0:
+                # Source shrank or the filesystem can not send, fall back
+                # instead of truncating.
+                raise CopyStrategyUnsupported()
+            offset += sent
+
+
+def _reflink(source_path, target_path):
+    '''Clone *source_path* to *target_path* sharing blocks copy on write.'''
+    if fcntl is None or not _same_filesystem(source_path, target_path):
+        raise CopyStrategyUnsupported()
+
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def _hardlink(source_path, target_path):
+    '''Hard link *target_path* to *source_path*.'''
+    if not allow_hardlinks or not _same_filesystem(source_path, target_path):
+        raise CopyStrategyUnsupported()
+
+    os.link(source_path, target_path)
+
+
+def _buffered(source_path, target_path):
+    '''Copy *source_path* to *target_path* through a large reused buffer.'''
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(source_path, 'rb', buffering=0) as source, open(
+        target_path, 'wb', buffering=0
+    ) as target:
+        for size in iter(lambda: source.readinto(buffer), 0):
+            written = 0
+            while written < size:
+                written += target.write(view[written:size])
+
+
+COPY_STRATEGIES = {
+    'copy_file_range': _copy_file_range,
+    'sendfile': _sendfile,
+    'reflink': _reflink,
+    'hardlink': _hardlink,
+    'buffered': _buffered,
+}
+
+
+def copy_file(source_path, target_path, strategies=None):
+    '''Copy *source_path* to *target_path* and return the strategy used.
+
+    *strategies* is an ordered list of names from :data:`COPY_STRATEGIES`,
+    defaulting to *copy_strategies*. Each one is tried in turn, falling back
+    to the next when unsupported for these files. The buffered copy is always
+    tried last.
+
+    '''
+    strategies = list(strategies or copy_strategies)
+    if 'buffered' not in strategies:
+        strategies.append('buffered')
+
+    for name in strategies:
+        try:
+            COPY_STRATEGIES[name](source_path, target_path)
+        except CopyStrategyUnsupported:
+            # Remove any partial copy before trying the next strategy.
+            if os.path.lexists(target_path):
+                os.remove(target_path)
+            continue
+        except OSError as error:
+            if name == 'buffered' or error.errno not in UNSUPPORTED_ERRORS:
+                raise
+
+            logger.debug(
+                'Copy strategy {0} failed for {1}: {2}'.format(
+                    name, source_path, error
+                )
+            )
+            if os.path.lexists(target_path):
+                os.remove(target_path)
+            continue
+
+        return name
+
+
+class DiskTransferLocationMixin(object):
+    '''Location mixin copying data between disk locations in kernel.
+
+    Single file components transferred from another location using a
+    :class:`ftrack_api.accessor.disk.DiskAccessor` are copied with
+    :func:`copy_file` rather than streamed through python.
+
+    '''
+
+    def _add_data(self, component, resource_identifier, source):
+        '''Manage transfer of *component* data from *source*.'''
+        if (
+            'members' in list(component.keys())
+            or not isinstance(self.accessor, ftrack_api.accessor.disk.DiskAccessor)
+            or not isinstance(
+                source.accessor, ftrack_api.accessor.disk.DiskAccessor
+            )
+        ):
+            return super(DiskTransferLocationMixin, self)._add_data(
+                component, resource_identifier, source
+            )
+
+        source_path = source.accessor.get_filesystem_path(
+            source.get_resource_identifier(component)
+        )
+        target_path = self.accessor.get_filesystem_path(resource_identifier)
+
+        if os.path.lexists(target_path):
+            raise ftrack_api.exception.LocationError(
+                'Cannot add component as data already exists and '
+                'overwriting could result in data loss. Computed '
+                'target resource identifier was: {0}'.format(resource_identifier)
+            )
+
+        target_directory = os.path.dirname(target_path)
+        if not os.path.isdir(target_directory):
+            try:
+                os.makedirs(target_directory)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+        strategy = copy_file(source_path, target_path)
+        logger.debug(
+            'Copied {0} to {1} using {2}'.format(source_path, target_path, strategy)
+        )
+
 
 def configure_location(session, location_setup, event):
     '''Configure location based on *location_setup*.'''
@@ -41,6 +253,7 @@ def configure_location(session, location_setup, event):
 
         location.accessor = ftrack_api.accessor.disk.DiskAccessor(prefix=disk_prefix)
         location.structure = ftrack_api.structure.standard.StandardStructure()
+        ftrack_api.mixin(location, DiskTransferLocationMixin)
         if location_name == current_location:
             location.priority = 1  # lower value == higher priority !
         else:
@@ -2,9 +2,23 @@
 
 import functools
 import logging
+import os
+import sys
 
 import ftrack_api
 
+CWD = os.path.dirname(__file__)
+
+DISPATCHER_DIRECTORY = os.environ.get(
+    'FTRACK_EVENT_DISPATCHER_PATH',
+    os.path.abspath(
+        os.path.join(CWD, '..', '..', 'sharded-dispatcher-0.0.0', 'dispatcher')
+    ),
+)
+sys.path.append(DISPATCHER_DIRECTORY)
+
+import sharded_dispatcher
+
 logger = logging.getLogger('com.ftrack.recipes.cascade_status_change')
 
 """
@@ -45,7 +59,7 @@ def send_message_to_user(session, user_id):
     )
 
 
-def get_status_list(task):
+def get_status_list(session, task):
     project = session.query(
         'select project_schema from Project '
         'where id is "{0}"'.format(task['project_id'])
@@ -64,14 +78,18 @@ def get_status_list(task):
     return task_statuses
 
 
-def status_lookup(task, status_id):
-    status_list = get_status_list(task)
+def status_lookup(session, task, status_id):
+    status_list = get_status_list(session, task)
     for status in status_list:
         if status['id'] == status_id:
             return status['name']
 
-def update_outgoing_task_status(session, event):
-    '''Event callback printing all new or updated entities.'''
+def update_outgoing_task_status(session, event, hub_session=None):
+    '''Event callback printing all new or updated entities.
+
+    Users are notified through the event hub of *hub_session*, or of
+    *session* if None.
+    '''
 
     user_id = event['source'].get('user', {}).get('id', None)
     status_changed = False
@@ -91,18 +109,18 @@ def update_outgoing_task_status(session, event):
             ).first()
 
             if task:
-                task_statuses = get_status_list(task)
+                task_statuses = get_status_list(session, task)
 
                 print("Upstream task id: {}".format(entity_id))
                 print("Upstream task name: {}".format(task['name']))
                 try:
-                    print("Upstream task old status: {}".format(status_lookup(task, entity['changes']['statusid']['old'])))
-                    print("Upstream task new status: {}".format(status_lookup(task, entity['changes']['statusid']['new'])))
+                    print("Upstream task old status: {}".format(status_lookup(session, task, entity['changes']['statusid']['old'])))
+                    print("Upstream task new status: {}".format(status_lookup(session, task, entity['changes']['statusid']['new'])))
                 except TypeError as e:
                     print("TypeError! {}".format(e))
 
                 #if task['status']['name'] == 'Approved':
-                if status_lookup(task, entity['changes']['statusid']['new']) == 'Approved':
+                if status_lookup(session, task, entity['changes']['statusid']['new']) == 'Approved':
 
                     print('Upstream Task is now "Approved"...')
 
@@ -161,7 +179,7 @@ def update_outgoing_task_status(session, event):
     if not user_id:
         return
 
-    send_message_to_user(session, user_id)
+    send_message_to_user(hub_session or session, user_id)
 
 
 def register(session, **kw):
@@ -173,10 +191,19 @@ def register(session, **kw):
     if not isinstance(session, ftrack_api.Session):
         return
 
+    # Handle events from worker threads, each one with its own session, so
+    # that slow queries do not hold back the event hub.
+    dispatcher = sharded_dispatcher.ShardedDispatcher(
+        'cascade_linked_task_status_changes',
+        session,
+        lambda worker_session: functools.partial(
+            update_outgoing_task_status, worker_session, hub_session=session
+        ),
+    )
+    dispatcher.start()
+
     # Register the event handler
-    #handle_event = functools.partial(cascade_status_changes_event_listener, session)
-    handle_event = functools.partial(update_outgoing_task_status, session)
-    session.event_hub.subscribe('topic=ftrack.update', handle_event)
+    session.event_hub.subscribe('topic=ftrack.update', dispatcher)
 
 
 if __name__ == '__main__':
@@ -1,31 +1,158 @@
 # :coding: utf-8
 # :copyright: Copyright (c) 2018 ftrack
 
+import collections
 import functools
 import logging
+import os
+import sys
+import threading
 
 import ftrack_api
 
+CWD = os.path.dirname(__file__)
+
+DISPATCHER_DIRECTORY = os.environ.get(
+    'FTRACK_EVENT_DISPATCHER_PATH',
+    os.path.abspath(
+        os.path.join(CWD, '..', '..', 'sharded-dispatcher-0.0.0', 'dispatcher')
+    ),
+)
+sys.path.append(DISPATCHER_DIRECTORY)
+
+import sharded_dispatcher
+
 logger = logging.getLogger('com.ftrack.recipes.cascade_status_change')
 
 
-def get_status_by_state(project, state):
-    '''Return a valid Status which matches *state*, for the given *project*.
+#: Seconds task status changes are buffered for before updating their Shots,
+#: so that a Shot is updated once for many of its tasks changing together.
+COALESCE_WINDOW = float(os.environ.get('FTRACK_CASCADE_STATUS_WINDOW', 2))
+
+#: Maximum number of ids in a single ``id in (...)`` query.
+QUERY_PAGE_SIZE = 500
+
+#: Entity types of updates which may change the statuses of a project schema.
+SCHEMA_ENTITY_TYPES = (
+    'projectschema',
+    'objecttypeschema',
+    'schemastatus',
+    'status',
+    'state',
+)
 
-    Raise an exception if the Shot Schema for *project* has no Status with the
-    given *state*.
+
+class StatusCache(object):
+    '''Shot Status ids by state short name, cached per project id.
+
+    The cache is filled for every project by :meth:`warm` and for new projects
+    the first time they are met, so resolving a status on an event makes no
+    server round-trip.
     '''
-    for status in project['project_schema'].get_statuses('Shot'):
-        if status['state']['short'] == state:
-            return status
+
+    def __init__(self):
+        self._status_ids = {}
+        self._status_names = {}
+        self._lock = threading.Lock()
+
+    def _load(self, session, schema_id):
+        '''Return Shot Status ids by state for project schema *schema_id*.'''
+        # Query the schema rather than get it, so that its object type
+        # schemas are fetched again once the cache was invalidated.
+        schema = session.query(
+            'select _schemas from ProjectSchema where id is "{0}"'.format(schema_id)
+        ).one()
+        status_ids = {}
+        for status in schema.get_statuses('Shot'):
+            # Keep the first status of each state, as the schema orders them.
+            status_ids.setdefault(status['state']['short'], status['id'])
+            self._status_names[status['id']] = status['name']
+        return status_ids
+
+    def warm(self, session):
+        '''Fill the cache for every project, using *session*.'''
+        # Fetch all statuses with their state up front, so that the schemas
+        # do not load them one by one.
+        session.query('select name, state.short from Status').all()
+
+        project_ids_by_schema = collections.defaultdict(list)
+        for project in session.query('select id, project_schema_id from Project'):
+            if not project['project_schema_id']:
+                continue
+            project_ids_by_schema[project['project_schema_id']].append(
+                project['id']
+            )
+
+        status_ids_by_project = {}
+        for schema_id, project_ids in project_ids_by_schema.items():
+            status_ids = self._load(session, schema_id)
+            for project_id in project_ids:
+                status_ids_by_project[project_id] = status_ids
+
+        with self._lock:
+            self._status_ids.update(status_ids_by_project)
+
+        logger.info(
+            'Cached Shot statuses of {0} projects'.format(len(status_ids_by_project))
+        )
+
+    def get(self, session, project_id, state):
+        '''Return id of the Shot Status matching *state* for *project_id*.
+
+        Return None if the project schema has no Shot Status with the given
+        *state*.
+        '''
+        with self._lock:
+            status_ids = self._status_ids.get(project_id)
+
+        if status_ids is None:
+            project = session.query(
+                'select project_schema_id from Project '
+                'where id is "{0}"'.format(project_id)
+            ).one()
+            status_ids = self._load(session, project['project_schema_id'])
+            with self._lock:
+                self._status_ids[project_id] = status_ids
+
+        return status_ids.get(state)
+
+    def get_name(self, status_id):
+        '''Return name of the cached Status with *status_id*.'''
+        return self._status_names.get(status_id)
+
+    def invalidate(self, project_id=None):
+        '''Forget the statuses of *project_id*, or of every project if None.'''
+        with self._lock:
+            if project_id is None:
+                self._status_ids.clear()
+            else:
+                self._status_ids.pop(project_id, None)
+
+
+def get_status_by_state(session, status_cache, project_id, state):
+    '''Return id of a valid Status which matches *state*, for *project_id*.
+
+    Raise an exception if the Shot Schema for the project has no Status with
+    the given *state*.
+    '''
+    status_id = status_cache.get(session, project_id, state)
+    if status_id is not None:
+        return status_id
 
     raise ValueError(
         'No valid Shot status matching state {} for project {}'.format(
-            state, project['full_name']
+            state, project_id
         )
     )
 
 
+def is_schema_change(entity):
+    '''Return if updated *entity* may change the statuses of a project.'''
+    if entity['entityType'] == 'show':
+        return 'projectschemaid' in entity.get('keys', [])
+    return entity['entityType'] in SCHEMA_ENTITY_TYPES
+
+
 def is_status_change(entity):
     '''Return if updated *entity* is a status change.'''
     is_task_entity = entity['entityType'] == 'task'
@@ -49,11 +176,12 @@ def get_state_name(task):
     return state
 
 
-def get_new_shot_status(shot, tasks):
+def get_new_shot_status(session, status_cache, shot, tasks):
     '''Update *shot* based on status of *tasks*.
 
     Given a *shot* and a list of *tasks* belonging to that shot, determine
-    the shots' status based on the task status'.
+    the shots' status based on the task status'. Statuses are resolved
+    through *status_cache*, using *session* for projects not cached yet.
     '''
     logger.info('Current shot status: {}'.format(shot['status']['name']))
 
@@ -61,29 +189,39 @@ def get_new_shot_status(shot, tasks):
         [get_state_name(task) for task in tasks],
     )
     task_states.discard(None)
-    project = shot['project']
-    new_status = None
+    project_id = shot['project_id']
+    new_status_id = None
 
     if task_states == set(
         ['DONE'],
     ):
-        new_status = get_status_by_state(project, 'DONE')
+        new_status_id = get_status_by_state(
+            session, status_cache, project_id, 'DONE'
+        )
     elif task_states == set(
         ['NOT_STARTED'],
     ):
-        new_status = get_status_by_state(project, 'NOT_STARTED')
+        new_status_id = get_status_by_state(
+            session, status_cache, project_id, 'NOT_STARTED'
+        )
     elif 'BLOCKED' in task_states:
-        new_status = get_status_by_state(project, 'BLOCKED')
+        new_status_id = get_status_by_state(
+            session, status_cache, project_id, 'BLOCKED'
+        )
     elif 'IN_PROGRESS' in task_states:
-        new_status = get_status_by_state(project, 'IN_PROGRESS')
+        new_status_id = get_status_by_state(
+            session, status_cache, project_id, 'IN_PROGRESS'
+        )
 
-    if new_status is None:
+    if new_status_id is None:
         logger.info('No appropriate state to set')
         return None
     logger.info(
-        'New shot status is {} ({})'.format(new_status['name'], new_status['id'])
+        'New shot status is {} ({})'.format(
+            status_cache.get_name(new_status_id), new_status_id
+        )
     )
-    return new_status['id']
+    return new_status_id
 
 
 def send_message_to_user(session, user_id):
@@ -108,37 +246,70 @@ def send_message_to_user(session, user_id):
     )
 
 
-def cascade_status_changes_event_listener(session, event):
-    '''Handle *event*.'''
-    user_id = event['source'].get('user', {}).get('id', None)
-    status_changed = False
+def cascade_status_changes(
+    session, status_cache, task_ids, user_ids, hub_session=None
+):
+    '''Update the Shots of tasks with *task_ids* from their tasks' statuses.
 
-    entities = event['data'].get('entities', [])
-    for entity in entities:
-        if not is_status_change(entity):
-            continue
+    Each Shot is updated once from a single query of the tasks of all Shots,
+    and all updates are committed together. Users with *user_ids* are then
+    notified through the event hub of *hub_session*, or of *session* if None.
+    '''
+    task_ids = list(task_ids)
+    shots = {}
+    for index in range(0, len(task_ids), QUERY_PAGE_SIZE):
+        for shot in session.query(
+            'select status_id, status.name, project_id from Shot '
+            'where children any (id in ({0}))'.format(
+                ', '.join(
+                    '"{0}"'.format(task_id)
+                    for task_id in task_ids[index:index + QUERY_PAGE_SIZE]
+                )
+            )
+        ):
+            shots[shot['id']] = shot
 
-        entity_id = entity['entityId']
-        shot = session.query(
-            'select status_id, status.name from Shot '
-            'where children any (id is "{0}")'.format(entity_id)
-        ).first()
-        if shot:
-            tasks = session.query(
-                'select type.name, status.state.short from Task '
-                'where parent_id is "{}"'.format(shot['id'])
+    if not shots:
+        logger.info('No shot found, ignoring update')
+        return
+
+    shot_ids = list(shots)
+    tasks_by_shot = collections.defaultdict(list)
+    for index in range(0, len(shot_ids), QUERY_PAGE_SIZE):
+        for task in session.query(
+            'select parent_id, type.name, status.state.short from Task '
+            'where parent_id in ({0})'.format(
+                ', '.join(
+                    '"{0}"'.format(shot_id)
+                    for shot_id in shot_ids[index:index + QUERY_PAGE_SIZE]
+                )
             )
-            new_shot_status_id = get_new_shot_status(shot, tasks)
-            if shot['status_id'] == new_shot_status_id:
-                logger.info('Status is unchanged.')
-                continue
-            if new_shot_status_id is None:
-                continue
-            shot['status_id'] = new_shot_status_id
-            status_changed = True
+        ):
+            tasks_by_shot[task['parent_id']].append(task)
+
+    logger.info(
+        'Rolling up status changes of {0} tasks into {1} shots'.format(
+            len(task_ids), len(shots)
+        )
+    )
 
-        else:
-            logger.info('No shot found, ignoring update')
+    status_changed = False
+    for shot_id, shot in shots.items():
+        try:
+            new_shot_status_id = get_new_shot_status(
+                session, status_cache, shot, tasks_by_shot[shot_id]
+            )
+        except ValueError:
+            logger.exception('Failed to resolve status of shot {0}'.format(shot_id))
+            continue
+
+        if shot['status_id'] == new_shot_status_id:
+            logger.info('Status is unchanged.')
+            continue
+        if new_shot_status_id is None:
+            continue
+        shot['status_id'] = new_shot_status_id
+        status_changed = True
 
     if not status_changed:
         return
@@ -152,10 +323,91 @@ def cascade_status_changes_event_listener(session, event):
         session.rollback()
         raise
 
-    if not user_id:
-        return
+    for user_id in user_ids:
+        send_message_to_user(hub_session or session, user_id)
 
-    send_message_to_user(session, user_id)
+
+class StatusChangeBuffer(object):
+    '''Buffer task status changes and roll them up into their Shots.
+
+    Changes are flushed *window* seconds after the first one buffered, from a
+    timer thread, so that tasks changed together update their Shot once.
+    With a *window* of 0, changes are flushed by the listener straight away.
+    Users are notified through the event hub of *hub_session*, or of
+    *session* if None.
+    '''
+
+    def __init__(
+        self, session, status_cache, window=COALESCE_WINDOW, hub_session=None
+    ):
+        self.session = session
+        self.status_cache = status_cache
+        self.window = window
+        self.hub_session = hub_session
+        self._task_ids = set()
+        self._user_ids = set()
+        self._timer = None
+        self._lock = threading.Lock()
+        # The session is not thread safe, only flush once at a time.
+        self._flush_lock = threading.Lock()
+
+    def add(self, task_id, user_id=None):
+        '''Buffer status change of task with *task_id*, made by *user_id*.'''
+        with self._lock:
+            self._task_ids.add(task_id)
+            if user_id:
+                self._user_ids.add(user_id)
+
+            if self.window > 0 and self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush_safely)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        '''Update the Shots of the tasks buffered so far.'''
+        with self._flush_lock:
+            with self._lock:
+                task_ids, self._task_ids = self._task_ids, set()
+                user_ids, self._user_ids = self._user_ids, set()
+                self._timer = None
+
+            if task_ids:
+                cascade_status_changes(
+                    self.session,
+                    self.status_cache,
+                    task_ids,
+                    user_ids,
+                    hub_session=self.hub_session,
+                )
+
+    def _flush_safely(self):
+        '''Flush from the timer thread, logging errors.'''
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to cascade status changes')
+
+
+def cascade_status_changes_event_listener(status_cache, status_changes, event):
+    '''Handle *event*.'''
+    user_id = event['source'].get('user', {}).get('id', None)
+
+    entities = event['data'].get('entities', [])
+    for entity in entities:
+        if is_schema_change(entity):
+            if entity['entityType'] == 'show':
+                status_cache.invalidate(entity['entityId'])
+            else:
+                status_cache.invalidate()
+            continue
+
+        if not is_status_change(entity):
+            continue
+
+        status_changes.add(entity['entityId'], user_id)
+
+    if status_changes.window <= 0:
+        status_changes.flush()
 
 
 def register(session, **kw):
@@ -167,9 +419,30 @@ def register(session, **kw):
     if not isinstance(session, ftrack_api.Session):
         return
 
+    # Resolve Shot statuses from a cache, filled up front.
+    status_cache = StatusCache()
+    status_cache.warm(session)
+
+    def create_handler(worker_session):
+        '''Return event handler for a worker using *worker_session*.'''
+        # Events are sharded by Shot, so buffering status changes per worker
+        # still updates each Shot once for tasks changed together.
+        status_changes = StatusChangeBuffer(
+            worker_session, status_cache, hub_session=session
+        )
+        return functools.partial(
+            cascade_status_changes_event_listener, status_cache, status_changes
+        )
+
+    # Handle events from worker threads, each one with its own session, so
+    # that slow queries do not hold back the event hub.
+    dispatcher = sharded_dispatcher.ShardedDispatcher(
+        'cascade_status_changes', session, create_handler
+    )
+    dispatcher.start()
+
     # Register the event handler
-    handle_event = functools.partial(cascade_status_changes_event_listener, session)
-    session.event_hub.subscribe('topic=ftrack.update', handle_event)
+    session.event_hub.subscribe('topic=ftrack.update', dispatcher)
 
 
 if __name__ == '__main__':
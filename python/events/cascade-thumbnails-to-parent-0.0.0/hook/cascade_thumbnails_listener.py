@@ -3,9 +3,23 @@
 
 
 import logging
+import os
+import sys
 import ftrack_api
 import functools
 
+CWD = os.path.dirname(__file__)
+
+DISPATCHER_DIRECTORY = os.environ.get(
+    "FTRACK_EVENT_DISPATCHER_PATH",
+    os.path.abspath(
+        os.path.join(CWD, "..", "..", "sharded-dispatcher-0.0.0", "dispatcher")
+    ),
+)
+sys.path.append(DISPATCHER_DIRECTORY)
+
+import sharded_dispatcher
+
 
 logger = logging.getLogger("com.ftrack.recipes.cascade_thumbnails_to_parent")
 
@@ -69,9 +83,17 @@ def register(session, **kw):
     if not isinstance(session, ftrack_api.Session):
         return
 
+    # Handle events from worker threads, each one with its own session, so
+    # that slow queries do not hold back the event hub.
+    dispatcher = sharded_dispatcher.ShardedDispatcher(
+        "cascade_thumbnails_to_parent",
+        session,
+        lambda worker_session: functools.partial(cascade_thumbnail, worker_session),
+    )
+    dispatcher.start()
+
     # Register the event handler
-    handle_event = functools.partial(cascade_thumbnail, session)
-    session.event_hub.subscribe("topic=ftrack.update", handle_event)
+    session.event_hub.subscribe("topic=ftrack.update", dispatcher)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+# :coding: utf-8
+# :copyright: Copyright (c) 2024 ftrack
+
+import logging
+import os
+import queue
+import threading
+import time
+
+import ftrack_api
+import ftrack_api.event.base
+
+logger = logging.getLogger('com.ftrack.recipes.sharded_dispatcher')
+
+#: Number of worker threads, each one handling the events of a shard.
+WORKERS = int(os.environ.get('FTRACK_EVENT_DISPATCHER_WORKERS', 4))
+
+#: Maximum number of events waiting in a shard, past which the event hub
+#: thread waits for the shard's worker to catch up.
+QUEUE_SIZE = int(os.environ.get('FTRACK_EVENT_DISPATCHER_QUEUE_SIZE', 1000))
+
+#: Seconds between two reports of the queue depths and handler latencies.
+REPORT_INTERVAL = float(os.environ.get('FTRACK_EVENT_DISPATCHER_REPORT_INTERVAL', 60))
+
+#: Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, float('inf'))
+
+
+def get_parent_id(entity):
+    '''Return id of the parent of *entity*, from the data of an event.
+
+    Fall back to the id of the entity itself if it has no parent.
+    '''
+    return entity.get('parentId') or entity.get('entityId')
+
+
+def split_event(event, entities):
+    '''Return copy of *event* updating only *entities*.'''
+    return ftrack_api.event.base.Event(
+        topic=event['topic'],
+        id=event['id'],
+        data=dict(event['data'], entities=entities),
+        sent=event['sent'],
+        source=event['source'],
+        target=event['target'],
+        in_reply_to_event=event['in_reply_to_event'],
+    )
+
+
+class LatencyHistogram(object):
+    '''Count of durations per bucket of :data:`LATENCY_BUCKETS`.'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, duration):
+        '''Record *duration*, in seconds.'''
+        with self._lock:
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    self.counts[index] += 1
+                    break
+            self.count += 1
+            self.total += duration
+
+    def to_dict(self):
+        '''Return counts by bucket upper bound, with the count and mean.'''
+        with self._lock:
+            return {
+                'buckets': dict(zip(self.buckets, self.counts)),
+                'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+            }
+
+    def __str__(self):
+        histogram = self.to_dict()
+        return '{0} events, mean {1:.3f}s, {2}'.format(
+            histogram['count'],
+            histogram['mean'],
+            ', '.join(
+                '<={0}s: {1}'.format(bound, count)
+                for bound, count in histogram['buckets'].items()
+                if count
+            ),
+        )
+
+
+class ShardedDispatcher(object):
+    '''Handle events from a pool of worker threads instead of the event hub.
+
+    The entities updated by an event are grouped by the key returned by
+    *get_shard_key* for each of them, by default their parent, and each group
+    is put as an event of its own on one of *workers* shards, chosen by a
+    hash of the key. Entities with the same key are handled in order by the
+    same worker, while a slow handler only holds back the events of its own
+    shard.
+
+    Each worker creates its own session, with the credentials of *session*,
+    and handles events with the callable returned by *handler_factory* when
+    called with that session.
+    '''
+
+    def __init__(
+        self,
+        name,
+        session,
+        handler_factory,
+        get_shard_key=get_parent_id,
+        workers=WORKERS,
+        queue_size=QUEUE_SIZE,
+        report_interval=REPORT_INTERVAL,
+    ):
+        self.name = name
+        self.session = session
+        self.handler_factory = handler_factory
+        self.get_shard_key = get_shard_key
+        self.report_interval = report_interval
+        self.wait = LatencyHistogram()
+        self.latency = LatencyHistogram()
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._workers = []
+        self._last_report = time.time()
+        self._report_lock = threading.Lock()
+
+    def create_session(self):
+        '''Return a new session for a worker.
+
+        The session does not discover plugins, as that would register the
+        listeners again, and does not connect to the event hub.
+        '''
+        return ftrack_api.Session(
+            server_url=self.session.server_url,
+            api_key=self.session.api_key,
+            api_user=self.session.api_user,
+            auto_connect_event_hub=False,
+            plugin_paths=[],
+        )
+
+    def start(self):
+        '''Start worker threads.'''
+        for index, shard in enumerate(self._queues):
+            worker = threading.Thread(
+                target=self._work,
+                args=(shard,),
+                name='{0}-{1}'.format(self.name, index),
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        '''Stop worker threads once they handled the events queued.'''
+        for shard in self._queues:
+            shard.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __call__(self, event):
+        '''Queue *event* on its shards, called from the event hub.
+
+        An event updating entities with different keys is split into one
+        event per key, so each key is only ever handled by its own shard.
+        '''
+        entities = event['data'].get('entities', [])
+        if not entities:
+            self._put(None, event)
+            return
+
+        groups = {}
+        for entity in entities:
+            groups.setdefault(self.get_shard_key(entity), []).append(entity)
+
+        if len(groups) == 1:
+            self._put(next(iter(groups)), event)
+            return
+
+        for key, group in groups.items():
+            self._put(key, split_event(event, group))
+
+    def get_statistics(self):
+        '''Return shard queue depths, queue waits and handler latencies.'''
+        return {
+            'queue_depth': [shard.qsize() for shard in self._queues],
+            'wait': self.wait.to_dict(),
+            'latency': self.latency.to_dict(),
+        }
+
+    def _put(self, key, event):
+        '''Queue *event* on the shard of *key*.'''
+        shard = self._queues[hash(key) % len(self._queues)]
+        shard.put((time.time(), event))
+
+    def _report(self):
+        '''Log statistics if :attr:`report_interval` passed since last time.'''
+        with self._report_lock:
+            now = time.time()
+            if now - self._last_report < self.report_interval:
+                return
+            self._last_report = now
+
+        logger.info(
+            '{0}: queue depth {1}, wait {2}, latency {3}'.format(
+                self.name,
+                [shard.qsize() for shard in self._queues],
+                self.wait,
+                self.latency,
+            )
+        )
+
+    def _work(self, shard):
+        '''Handle the events of *shard* until a None event is queued.'''
+        session = self.create_session()
+        handler = self.handler_factory(session)
+
+        while True:
+            item = shard.get()
+            if item is None:
+                break
+
+            queued, event = item
+            started = time.time()
+            self.wait.observe(started - queued)
+            try:
+                handler(event)
+            except Exception:
+                logger.exception(
+                    '{0}: failed to handle event {1}'.format(self.name, event['id'])
+                )
+            finally:
+                self.latency.observe(time.time() - started)
+            self._report()
+
+        session.close()
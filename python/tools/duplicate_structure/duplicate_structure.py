@@ -1,9 +1,15 @@
 # :coding: utf-8
 # :copyright: Copyright (c) 2024 Backlight
 
+import os
+import json
 import logging
 import argparse
-import itertools
+import array
+import copy
+import collections
+import threading
+import concurrent.futures
 import time
 import re
 
@@ -19,6 +25,10 @@ logging.basicConfig()
 # data that we want to duplicate.
 session = ftrack_api.Session(auto_populate=False)
 
+# Maximum number of IDs in a single `id in (...)` query, to keep queries and
+# responses within a reasonable size on large structures.
+QUERY_PAGE_SIZE = 500
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
@@ -34,6 +44,44 @@ def parse_arguments():
             'structure under.'
         )
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=500,
+        help='Number of entities created per commit.'
+    )
+    parser.add_argument(
+        '--id-map',
+        help=(
+            'File recording the ID of each duplicated entity, by original '
+            'ID. Defaults to duplicate_<source>_<destination>.json.'
+        )
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help=(
+            'Number of subtrees duplicated concurrently, each worker using '
+            'its own session.'
+        )
+    )
+    parser.add_argument(
+        '--plan',
+        help=(
+            'Only plan the duplication: print an estimate of its cost and '
+            'save the plan to this file.'
+        )
+    )
+    parser.add_argument(
+        '--execute-plan',
+        help='Duplicate the structure saved to this file by --plan.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume a failed duplication from the ID map.'
+    )
 
     return parser.parse_args()
 
@@ -46,11 +94,123 @@ def validate_args(args):
     except Exception:
         return False
 
-class DuplicateStructure(object):
+class Hierarchy(object):
+    # Flat, breadth first representation of a structure to duplicate.
+    #
+    # Node `index` is described by its original ID and by its entries in the
+    # parent, name and object type columns, which hold indices into the node
+    # list, the interned name table and the object type table. Parents always
+    # come before their children, the root has no parent (-1).
     def __init__(self):
+        self.original_ids = []
+        self.parents = array.array('l')
+        self.name_indices = array.array('l')
+        self.type_indices = array.array('l')
+        self.names = []
+        self.object_types = []
+        self._name_lookup = {}
+        self._type_lookup = {}
+
+    def __len__(self):
+        return len(self.original_ids)
+
+    def _intern(self, table, lookup, value):
+        index = lookup.get(value)
+        if index is None:
+            index = lookup[value] = len(table)
+            table.append(value)
+        return index
+
+    def add(self, original_id, parent, name, object_type):
+        self.original_ids.append(original_id)
+        self.parents.append(parent)
+        self.name_indices.append(self._intern(self.names, self._name_lookup, name))
+        self.type_indices.append(
+            self._intern(self.object_types, self._type_lookup, object_type)
+        )
+        return len(self.original_ids) - 1
+
+    def subset(self, indices):
+        # Return hierarchy of the nodes at `indices`, given in hierarchy
+        # order. Nodes whose parent is not part of it become roots.
+        positions = {index: position for position, index in enumerate(indices)}
+        subset = Hierarchy()
+        for index in indices:
+            subset.add(
+                self.original_ids[index],
+                positions.get(self.parents[index], -1),
+                self.name(index),
+                self.object_type(index)
+            )
+        return subset
+
+    def to_dict(self):
+        return {
+            'original_ids': self.original_ids,
+            'parents': self.parents.tolist(),
+            'name_indices': self.name_indices.tolist(),
+            'type_indices': self.type_indices.tolist(),
+            'names': self.names,
+            'object_types': self.object_types
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        hierarchy = cls()
+        hierarchy.original_ids = data['original_ids']
+        hierarchy.parents = array.array('l', data['parents'])
+        hierarchy.name_indices = array.array('l', data['name_indices'])
+        hierarchy.type_indices = array.array('l', data['type_indices'])
+        hierarchy.names = data['names']
+        hierarchy.object_types = data['object_types']
+        hierarchy._name_lookup = {
+            name: index for index, name in enumerate(hierarchy.names)
+        }
+        hierarchy._type_lookup = {
+            object_type: index
+            for index, object_type in enumerate(hierarchy.object_types)
+        }
+        return hierarchy
+
+    def name(self, index):
+        return self.names[self.name_indices[index]]
+
+    def object_type(self, index):
+        return self.object_types[self.type_indices[index]]
+
+
+class DuplicateStructure(object):
+    def __init__(
+        self, batch_size=500, id_map_path=None, resume=False, workers=1,
+        plan_path=None, execute_plan_path=None
+    ):
         self.logger = logging.getLogger('com.ftrack.recipes.tools.duplicate_structure')
         self.logger.setLevel(logging.INFO)
 
+        self._session = session
+
+        # With more than one worker, the subtrees under the first level are
+        # duplicated concurrently, each worker using its own session.
+        self._workers = max(1, workers)
+        self._worker_local = threading.local()
+        self._worker_sessions = []
+        self._id_map_lock = threading.Lock()
+
+        # Entities are created and committed in batches of `batch_size`, and
+        # the mapping from original to new IDs is saved to `id_map_path` after
+        # each commit so a failed duplication can be resumed.
+        self._batch_size = max(1, batch_size)
+        self._id_map_path = id_map_path
+        self._resume = resume
+        self._id_map = {}
+        self._populated = False
+        self._failed = False
+
+        # In plan mode only the hierarchy is fetched, and saved along with an
+        # estimate of the duplication cost so it can be executed later.
+        self._plan_path = plan_path
+        self._execute_plan_path = execute_plan_path
+
         self._dry_run = False
         if self._dry_run:
             self.logger.info(
@@ -62,16 +222,38 @@ class DuplicateStructure(object):
 
         self._source_entity_id = source_entity_id
         self._destination_entity_id = destination_entity_id
+        if self._id_map_path is None:
+            self._id_map_path = (
+                f'duplicate_{source_entity_id}_{destination_entity_id}.json'
+            )
+        if self._resume:
+            self._load_id_map()
         self._ignore_data_keys = [
             'project_id', 'ancestors', 'descendants', 'lists',
             'incoming_links', 'outgoing_links', 'status_changes',
             'parent_id', 'children', 'assets', 'timelogs', 'scopes',
-            '_link', 'managers', 'appointments', 'allocations'
+            '_link', 'managers', 'appointments', 'allocations',
+            # Copied in bulk by `_copy_links_and_attributes`
+            'assignments', 'custom_attributes'
         ]
         self._ignore_data_keys_by_type = {
             'Task': ['split_parts'] + self._ignore_data_keys
         }
-        self._entities_lookup = self._create_entity_lookup()
+        if self._execute_plan_path:
+            self._hierarchy = self._load_plan()
+        else:
+            self._entities_lookup = self._create_entity_lookup()
+            source_entity = self._entities_lookup[self._source_entity_id]
+
+            # Create a flat representation of all TypedContext entities to
+            # duplicate starting with the root at `_source_entity_id`
+            self._hierarchy = self._build_hierarchy_representation(
+                source_entity, source_entity['name'] + str(time.time())
+            )
+
+        if self._plan_path:
+            self._plan()
+            return
 
         self._run()
         self._post_actions()
@@ -79,7 +261,7 @@ class DuplicateStructure(object):
     def _create_entity_lookup(self):
         self.logger.debug('Creating entity lookup dictionary...')
         entities_lookup = {}
-        self.entities_to_copy = session.query(
+        self.entities_to_copy = self._session.query(
             'select name, object_type.name, project.children, children, parent_id '
             f'from TypedContext where ancestors any (id={self._source_entity_id}) '
             f'or id is "{self._source_entity_id}"'
@@ -101,63 +283,171 @@ class DuplicateStructure(object):
                 continue
             print("{: >20} {: >20}".format(*[attribute.name, str(entity[attribute.name])]))
     
-    def _build_hierarchy_representation(self, entities, parent_id, level):
+    def _build_hierarchy_representation(self, source_entity, root_name):
         self.logger.debug('Building hierarchy...')
-        def iterate(entities, parent_id, level):
-            def process_entity(entity, parent_id, level):
-                level = level + 1
-                entity_dict = {
-                    'parent_id': parent_id,
-                    'name': entity['name'],
-                    'object_type': entity['object_type']['name'],
-                    'metadata': {
-                        'original_id': entity['id']
-                    },
-                    'level': level # primarily for debugging purposes
-                }
-                if len(entity['children']) > 0:
-                    entity_dict['children'] = iterate(
-                        entity['children'],
-                        parent_id,
-                        level
-                    )
-                return entity_dict
-            return map(process_entity, entities, itertools.repeat(parent_id), itertools.repeat(level))
-        return iterate(entities, parent_id, level)
-    
-    def _record_operations(self, entities, root, created_entities_ids):
+        hierarchy = Hierarchy()
+        queue = collections.deque([(source_entity, -1)])
+        while queue:
+            entity, parent = queue.popleft()
+            index = hierarchy.add(
+                entity['id'],
+                parent,
+                root_name if parent < 0 else entity['name'],
+                entity['object_type']['name']
+            )
+            queue.extend((child, index) for child in entity['children'])
+        self.logger.debug(f'Built hierarchy of {len(hierarchy)} entities.')
+        return hierarchy
+
+    def _load_id_map(self):
+        if not os.path.isfile(self._id_map_path):
+            self.logger.warning(
+                f'No ID map found at {self._id_map_path}, starting over.'
+            )
+            return
+        with open(self._id_map_path) as id_map_file:
+            data = json.load(id_map_file)
+        self._id_map = data['ids']
+        self._populated = data['populated']
+        self.logger.info(
+            f'Resuming with {len(self._id_map)} entities already duplicated.'
+        )
+
+    def _save_id_map(self):
+        if self._dry_run:
+            return
+        with open(self._id_map_path + '.tmp', 'w') as id_map_file:
+            json.dump(
+                {
+                    'source_entity_id': self._source_entity_id,
+                    'destination_entity_id': self._destination_entity_id,
+                    'ids': self._id_map,
+                    'populated': self._populated
+                },
+                id_map_file
+            )
+        os.replace(self._id_map_path + '.tmp', self._id_map_path)
+
+    def _commit_batch(self, pending):
+        # Commit the entities created since last commit, and only then record
+        # them in the ID map.
+        if not pending:
+            return True
+        if not self._commit_operations():
+            self.logger.error(
+                f'Failed to create {len(pending)} entities, run again with '
+                f'--resume to continue from {self._id_map_path}.'
+            )
+            return False
+        # The ID map is shared with workers duplicating other subtrees.
+        with self._id_map_lock:
+            self._id_map.update(pending)
+            self._save_id_map()
+            created = len(self._id_map)
+        pending.clear()
+        self.logger.info(f'Created {created} entities...')
+        return True
+
+    def _record_operations(self, hierarchy, root):
+        # Create entities in hierarchy order, which is breadth first, so that
+        # parents are always committed in the same or an earlier batch than
+        # their children.
         self.logger.debug('Recording operations...')
-        for entity in entities:
-            new_entity = session.create(entity['object_type'], {
-                'parent_id': root,
-                'name': entity['name'],
-                'metadata': entity['metadata']
-            })
-            created_entities_ids.append(new_entity['id'])
-            if 'children' in entity:
-                self._record_operations(entity['children'], new_entity['id'], created_entities_ids)
-        return created_entities_ids
+        new_ids = [None] * len(hierarchy)
+        pending = {}
+        for index in range(len(hierarchy)):
+            original_id = hierarchy.original_ids[index]
+            parent = hierarchy.parents[index]
+            new_id = self._id_map.get(original_id)
+            if new_id is None:
+                new_entity = self._session.create(hierarchy.object_type(index), {
+                    'parent_id': root if parent < 0 else new_ids[parent],
+                    'name': hierarchy.name(index),
+                    'metadata': {
+                        'original_id': original_id
+                    }
+                })
+                new_id = new_entity['id']
+                pending[original_id] = new_id
+                if len(pending) >= self._batch_size and not self._commit_batch(pending):
+                    return False
+            new_ids[index] = new_id
+        return self._commit_batch(pending)
+
+    def _get_worker_session(self):
+        session = getattr(self._worker_local, 'session', None)
+        if session is None:
+            session = ftrack_api.Session(auto_populate=False)
+            self._worker_local.session = session
+            with self._id_map_lock:
+                self._worker_sessions.append(session)
+        return session
+
+    def _record_subtree(self, hierarchy, root):
+        # Duplicate `hierarchy` under `root` in a worker thread, using a copy
+        # of this instance bound to the worker session. The copy shares the ID
+        # map, so created entities are merged into it as they are committed.
+        worker = copy.copy(self)
+        worker._session = self._get_worker_session()
+        return worker._record_operations(hierarchy, root)
+
+    def _record_operations_concurrently(self, hierarchy, root):
+        # Create the root and first level first, then hand the subtree under
+        # each first level entity to a worker, as they are independent.
+        depths = array.array('l', [0]) * len(hierarchy)
+        branches = array.array('l', [-1]) * len(hierarchy)
+        top = []
+        subtrees = collections.OrderedDict()
+        for index in range(len(hierarchy)):
+            parent = hierarchy.parents[index]
+            if parent >= 0:
+                depths[index] = depths[parent] + 1
+            if depths[index] <= 1:
+                top.append(index)
+                branches[index] = index
+            else:
+                branches[index] = branches[parent]
+                subtrees.setdefault(branches[index], []).append(index)
+
+        if not self._record_operations(hierarchy.subset(top), root):
+            return False
+
+        self.logger.info(
+            f'Duplicating {len(subtrees)} subtrees using {self._workers} workers...'
+        )
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._workers)
+        try:
+            futures = [
+                executor.submit(
+                    self._record_subtree,
+                    hierarchy.subset(indices),
+                    self._id_map[hierarchy.original_ids[branch]]
+                )
+                for branch, indices in subtrees.items()
+            ]
+            results = [future.result() for future in futures]
+        finally:
+            executor.shutdown(wait=True)
+            for worker_session in self._worker_sessions:
+                worker_session.close()
+            self._worker_sessions = []
+        return all(results)
 
     def _run(self):
         self.logger.debug('Running...')
-        source_entity = self._entities_lookup[self._source_entity_id]
-        self._created_entities_ids = []
-
-        # Create a dict recursively of all TypedContext entities to duplicate
-        # starting with the root at `_source_entity_id`
-        hierarchy = self._build_hierarchy_representation([
-            {
-                'id': self._source_entity_id,
-                'name': source_entity['name'] + str(time.time()),
-                'object_type': source_entity['object_type'],
-                'children': source_entity['children']
-            }
-        ], self._source_entity_id, 0)
-        
-        self._created_entities_ids = \
-            self._record_operations(list(hierarchy), self._destination_entity_id, [])
-        
-        self._commit_operations()
+        hierarchy = self._hierarchy
+
+        if self._workers > 1:
+            succeeded = self._record_operations_concurrently(
+                hierarchy, self._destination_entity_id
+            )
+        else:
+            succeeded = self._record_operations(
+                hierarchy, self._destination_entity_id
+            )
+        if not succeeded:
+            self._failed = True
+        self._created_entities_ids = list(self._id_map.values())
 
     def _populate_entities(self):
         # TODO: move this to a job
@@ -165,12 +455,10 @@ class DuplicateStructure(object):
         self.logger.debug('Populating entities...')
 
         # Retrieve the created, not yet fully populated TypedContext entities.
-        created_entities = session.query(
-            'select object_type, metadata, custom_attributes from TypedContext '
-            'where id in ("' +
-            '","'.join(self._created_entities_ids) +
-            '")'
-        ).all()
+        created_entities = self._query_in_pages(
+            'select object_type.name, metadata from TypedContext',
+            self._created_entities_ids
+        )
 
         # Create a set holding the types of objects created (Task, Shot, etc.)
         # to avoid fetching and working with all object types/schemas.
@@ -181,14 +469,14 @@ class DuplicateStructure(object):
         # Create a dict of all immutable attributes (to later exclude from
         # attributes to populate)
         immutable_attributes = {}
-        for schema in session.schemas:
+        for schema in self._session.schemas:
             if schema['id'] in object_types_created:
                 immutable_attributes[schema['id']] = schema['immutable']
         
         # Create dict of all attributes that should be retrieved and populated.
         attributes_to_populate = {}
         for object_type in object_types_created:
-            for attribute in session.types[object_type].attributes:
+            for attribute in self._session.types[object_type].attributes:
                 if (
                     attribute.name in immutable_attributes[object_type]
                     or (
@@ -209,19 +497,52 @@ class DuplicateStructure(object):
         
         original_entities_lookup = {}
 
+        # Partition the original entities by object type, so that each one is
+        # only fetched once, with the attributes of its own type.
+        original_ids_by_object_type = collections.defaultdict(list)
+        for index in range(len(self._hierarchy)):
+            original_ids_by_object_type[self._hierarchy.object_type(index)].append(
+                self._hierarchy.original_ids[index]
+            )
+
         # Retrieve the original entities populated with the attributes we want
         # to copy to the new entities.
+        fetched_bytes = 0
+        estimated_bytes = 0
+        queries = 0
         for object_type in object_types_created:
             attribute_list = ", ".join([attribute.name for attribute in attributes_to_populate[object_type]])
+            original_ids = original_ids_by_object_type[object_type]
 
-            original_entities = session.query(
-                f'select {attribute_list},assignments.resource_id from TypedContext where id in '
-                '("' + '","'.join(self._entities_lookup.keys()) + '")'
-            ).all()
+            original_entities = self._query_in_pages(
+                f'select {attribute_list} from TypedContext',
+                original_ids
+            )
+            queries += -(-len(original_ids) // QUERY_PAGE_SIZE)
+
+            type_bytes = sum(
+                len(self._session.encode(entity, entity_attribute_strategy='set_only'))
+                for entity in original_entities
+            )
+            fetched_bytes += type_bytes
+            if original_entities:
+                # Previously all originals were fetched for every type.
+                estimated_bytes += (
+                    type_bytes * len(self._hierarchy) // len(original_entities)
+                )
             for entity in original_entities:
                 original_entities_lookup[entity['id']] = entity
-        
-        # Copy data from the original entities to the new entities.
+
+        self.logger.info(
+            f'Fetched {len(original_entities_lookup)} original entities '
+            f'({fetched_bytes} bytes) in {queries} queries, instead of '
+            f'{len(object_types_created) * len(self._hierarchy)} entities '
+            f'(~{estimated_bytes} bytes) when fetching all of them per type.'
+        )
+
+        # Copy data from the original entities to the new entities, committing
+        # the updates in batches of `_batch_size` entities.
+        pending = 0
         for created_entity in created_entities:
             if 'original_id' in created_entity['metadata']:
                 original_id = created_entity['metadata']['original_id']
@@ -234,29 +555,283 @@ class DuplicateStructure(object):
                     continue
                 if isinstance(attribute, ftrack_api.attribute.ScalarAttribute):
                     created_entity[attribute.name] = original_entity[attribute.name]
-                elif isinstance(attribute, ftrack_api.attribute.KeyValueMappedCollectionAttribute):
+                elif attribute.name == 'metadata':
                     for metadata in original_entity['metadata'].items():
                         created_entity['metadata'][metadata[0]] = metadata[1]
-                    for custom_attribute in original_entity['custom_attributes'].items():
-                        created_entity['custom_attributes'][custom_attribute[0]] = custom_attribute[1]
-                elif isinstance(attribute, ftrack_api.attribute.CollectionAttribute):
-                    if attribute.name == 'assignments':
-                        for assignee in original_entity['assignments']:
-                            session.create('Appointment', {
-                                'type': 'assignment',
-                                'context_id': created_entity['id'],
-                                'resource_id': assignee['resource_id']
-                            })
-
-        self._commit_operations()
+
+            pending += 1
+            if pending >= self._batch_size:
+                if not self._commit_operations():
+                    return
+                pending = 0
+
+        if self._commit_operations() and self._copy_links_and_attributes():
+            self._populated = True
+            self._save_id_map()
+
+    def _copy_links_and_attributes(self):
+        # Copy the assignments and custom attribute values of the whole source
+        # structure, collected with one paged pass each instead of entity by
+        # entity, and created in batches of `_batch_size`. Custom attribute
+        # values of non hierarchical configurations equal to their default are
+        # not copied, as new entities already fall back to the default.
+        # Hierarchical values are always copied, a default set explicitly on
+        # a child overrides the value inherited from its parent.
+        self.logger.debug('Copying assignments and custom attributes...')
+        appointments, values, skipped = self._collect_links_and_attributes(
+            list(self._id_map.keys())
+        )
+
+        # When resuming, batches committed by the interrupted run already
+        # exist on the new entities, skip them rather than creating them again.
+        existing_appointments, existing_values = set(), set()
+        if self._resume:
+            existing_appointments, existing_values = self._collect_existing_links(
+                list(self._id_map.values())
+            )
+        existing = len(appointments) + len(values)
+        appointments = [
+            appointment for appointment in appointments
+            if (
+                self._id_map[appointment['context_id']], appointment['resource_id']
+            ) not in existing_appointments
+        ]
+        values = [
+            value for value in values
+            if (
+                value['configuration_id'], self._id_map[value['entity_id']]
+            ) not in existing_values
+        ]
+        existing -= len(appointments) + len(values)
+
+        pending = 0
+        created = 0
+        for appointment in appointments:
+            self._session.create('Appointment', {
+                'type': 'assignment',
+                'context_id': self._id_map[appointment['context_id']],
+                'resource_id': appointment['resource_id']
+            })
+            pending += 1
+            if pending >= self._batch_size:
+                if not self._commit_operations():
+                    return False
+                created += pending
+                pending = 0
+
+        for value in values:
+            self._session.create('ContextCustomAttributeValue', {
+                'configuration_id': value['configuration_id'],
+                'entity_id': self._id_map[value['entity_id']],
+                'value': value['value']
+            })
+            pending += 1
+            if pending >= self._batch_size:
+                if not self._commit_operations():
+                    return False
+                created += pending
+                pending = 0
+
+        if not self._commit_operations():
+            return False
+        created += pending
+        self.logger.info(
+            f'Copied {created} assignments and custom attribute values, '
+            f'skipped {skipped} non hierarchical values equal to their default '
+            f'and {existing} already copied.'
+        )
+        return True
+
+    def _collect_existing_links(self, new_ids):
+        # Return the (context, resource) pairs of the assignments and the
+        # (configuration, entity) pairs of the custom attribute values already
+        # set on `new_ids`.
+        appointments = set(
+            (appointment['context_id'], appointment['resource_id'])
+            for appointment in self._query_in_pages(
+                'select context_id, resource_id from Appointment',
+                new_ids,
+                key='context_id',
+                where='type is "assignment"'
+            )
+        )
+        values = set(
+            (value['configuration_id'], value['entity_id'])
+            for value in self._query_in_pages(
+                'select configuration_id, entity_id '
+                'from ContextCustomAttributeValue',
+                new_ids,
+                key='entity_id'
+            )
+        )
+        return appointments, values
+
+    def _collect_links_and_attributes(self, original_ids):
+        # Return the assignments and the custom attribute values to copy for
+        # `original_ids`, along with the number of values skipped because they
+        # equal the default of their non hierarchical configuration.
+        defaults = {}
+        for configuration in self._session.query(
+            'select id, default, is_hierarchical from CustomAttributeConfiguration'
+        ):
+            if not configuration['is_hierarchical']:
+                defaults[configuration['id']] = configuration['default']
+
+        appointments = self._query_in_pages(
+            'select context_id, resource_id from Appointment',
+            original_ids,
+            key='context_id',
+            where='type is "assignment"'
+        )
+
+        values = []
+        skipped = 0
+        for value in self._query_in_pages(
+            'select configuration_id, entity_id, value '
+            'from ContextCustomAttributeValue',
+            original_ids,
+            key='entity_id'
+        ):
+            if (
+                value['configuration_id'] in defaults
+                and value['value'] == defaults[value['configuration_id']]
+            ):
+                skipped += 1
+                continue
+            values.append(value)
+        return appointments, values, skipped
+
+    def _probe(self):
+        # Time a minimal query to measure the round trip latency, then a page
+        # of original entities to measure the cost of each entity.
+        started = time.time()
+        for _ in range(3):
+            self._session.query(
+                f'select id from TypedContext where id is "{self._source_entity_id}"'
+            ).all()
+        latency = (time.time() - started) / 3
+
+        page = self._hierarchy.original_ids[:QUERY_PAGE_SIZE]
+        started = time.time()
+        self._query_in_pages(
+            'select name, object_type_id, parent_id, description, '
+            'start_date, end_date, bid, priority_id, status_id, type_id '
+            'from TypedContext',
+            page
+        )
+        per_entity = max(0, time.time() - started - latency) / max(1, len(page))
+        return latency, per_entity
+
+    def _plan(self):
+        hierarchy = self._hierarchy
+        counts = collections.Counter(
+            hierarchy.object_type(index) for index in range(len(hierarchy))
+        )
+        appointments, values, skipped = self._collect_links_and_attributes(
+            hierarchy.original_ids
+        )
+
+        def pages(count, size):
+            return -(-count // size)
+
+        entities = len(hierarchy)
+        links = len(appointments) + len(values)
+        # Creation batches, population batches and the bulk copy of links.
+        commits = (
+            2 * pages(entities, self._batch_size) + 1
+            + pages(links, self._batch_size) + 1
+        )
+        # Queries fetching created entities, originals per object type,
+        # configurations, assignments and custom attribute values.
+        queries = (
+            pages(entities, QUERY_PAGE_SIZE)
+            + sum(pages(count, QUERY_PAGE_SIZE) for count in counts.values())
+            + 1
+            + 2 * pages(entities, QUERY_PAGE_SIZE)
+        )
+        latency, per_entity = self._probe()
+        # Entities are created, populated and fetched twice, links created.
+        seconds = (
+            (commits + queries) * latency
+            + (4 * entities + links) * per_entity
+        ) / max(1, self._workers)
+
+        plan = {
+            'source_entity_id': self._source_entity_id,
+            'destination_entity_id': self._destination_entity_id,
+            'hierarchy': hierarchy.to_dict(),
+            'estimate': {
+                'entities': dict(counts),
+                'assignments': len(appointments),
+                'custom_attributes': len(values),
+                'custom_attributes_skipped': skipped,
+                'commits': commits,
+                'round_trips': commits + queries,
+                'latency': latency,
+                'seconds_per_entity': per_entity,
+                'seconds': seconds
+            }
+        }
+
+        for object_type, count in sorted(counts.items()):
+            self.logger.info(f'{object_type}: {count}')
+        self.logger.info(
+            f'{entities} entities, {len(appointments)} assignments and '
+            f'{len(values)} custom attribute values to copy ({skipped} non '
+            f'hierarchical values equal to their default).'
+        )
+        self.logger.info(
+            f'About {commits} commits and {commits + queries} server round '
+            f'trips, estimated to take {seconds:.0f}s (measured {latency:.3f}s '
+            f'latency and {per_entity:.4f}s per entity).'
+        )
+
+        with open(self._plan_path, 'w') as plan_file:
+            json.dump(plan, plan_file)
+        self.logger.info(f'Saved plan to {self._plan_path}.')
+
+    def _load_plan(self):
+        with open(self._execute_plan_path) as plan_file:
+            plan = json.load(plan_file)
+        if (
+            plan['source_entity_id'] != self._source_entity_id
+            or plan['destination_entity_id'] != self._destination_entity_id
+        ):
+            raise ValueError(
+                f'Plan {self._execute_plan_path} duplicates '
+                f'{plan["source_entity_id"]} to {plan["destination_entity_id"]}.'
+            )
+        hierarchy = Hierarchy.from_dict(plan['hierarchy'])
+        self.logger.info(
+            f'Loaded plan of {len(hierarchy)} entities from '
+            f'{self._execute_plan_path}.'
+        )
+        return hierarchy
+
+    def _query_in_pages(self, select, ids, key='id', where=None):
+        # Run `select` restricted to entities with `key` in `ids`, at most
+        # `QUERY_PAGE_SIZE` at a time, and to the optional `where` criteria.
+        ids = list(ids)
+        criteria = f'{where} and ' if where else ''
+        entities = []
+        for index in range(0, len(ids), QUERY_PAGE_SIZE):
+            entities.extend(self._session.query(
+                f'{select} where {criteria}{key} in ("' +
+                '","'.join(ids[index:index + QUERY_PAGE_SIZE]) +
+                '")'
+            ).all())
+        return entities
 
     def _commit_operations(self):
         if not self._dry_run:
             try:
-                session.commit()
+                self._session.commit()
             except Exception as error:
                 self.logger.info('Server error on commit:')
                 self.logger.exception(error)
+                self._session.rollback()
+                return False
+        return True
     
     def _pre_actions(self):
         # TODO: Check if same schema
@@ -265,6 +840,8 @@ class DuplicateStructure(object):
     def _post_actions(self):
         # TODO: Optionally delete source entities
 
+        if self._failed or self._populated:
+            return
         self._populate_entities()
 
 
@@ -274,5 +851,12 @@ if __name__ == '__main__':
     if not validate_args(args):
         print('At least one of the UUIDs is invalid.')
 
-    duplicate_structure = DuplicateStructure()
+    duplicate_structure = DuplicateStructure(
+        batch_size=args.batch_size,
+        id_map_path=args.id_map,
+        resume=args.resume,
+        workers=args.workers,
+        plan_path=args.plan,
+        execute_plan_path=args.execute_plan
+    )
     duplicate_structure.process(args.source_entity_id, args.destination_entity_id)
@@ -4,10 +4,19 @@ Copyright (c) 2014-2020 ftrack
 
 '''
 
+import os
 import logging
 import argparse
 import sys
 import json
+import io
+import copy
+import functools
+import time
+import threading
+import concurrent.futures
+import uuid
+import hashlib
 import ftrack_api
 
 logging.basicConfig(
@@ -17,6 +26,140 @@ logging.basicConfig(
 )
 logger = logging.getLogger("com.ftrack.recipes.tools.manage_project_schemas")
 
+# Projection fetching everything serialised from a workflow schema.
+WORKFLOW_SCHEMA_PROJECTION = [
+    'id',
+    'name',
+    'statuses.name',
+    'statuses.color',
+    'statuses.is_active',
+    'statuses.sort',
+]
+
+# Projection fetching everything serialised from a project schema, used by
+# backup workers whose sessions do not populate attributes on access.
+PROJECT_SCHEMA_PROJECTION = (
+    [
+        'id',
+        'name',
+        'object_types.id',
+        'object_types.name',
+        'object_types.icon',
+        'object_types.is_leaf',
+        'object_types.is_schedulable',
+        'object_types.is_statusable',
+        'object_types.is_taskable',
+        'object_types.is_time_reportable',
+        'object_types.is_typeable',
+        'object_types.sort',
+        'object_type_schemas.type_id',
+        'object_type_schemas.statuses.status_id',
+        'object_type_schemas.types.type_id',
+        'task_templates.name',
+        'task_templates.items.task_type_id',
+        'task_type_schema.id',
+        'task_type_schema.name',
+        'task_type_schema.types.name',
+        'task_type_schema.types.color',
+        'task_type_schema.types.is_billable',
+        'task_type_schema.types.sort',
+        'task_workflow_schema_overrides.type_id',
+    ]
+    + [
+        '{0}.{1}'.format(relation, attribute)
+        for relation in [
+            'task_workflow_schema',
+            'task_workflow_schema_overrides.workflow_schema',
+            'asset_version_workflow_schema',
+        ]
+        for attribute in WORKFLOW_SCHEMA_PROJECTION
+    ]
+)
+
+
+def is_snapshot(filename):
+    """Return whether *filename* uses the line delimited snapshot format."""
+    return filename.endswith('.jsonl')
+
+
+def get_content_hash(entity):
+    """Return hash of serialised *entity*."""
+    return hashlib.sha1(
+        json.dumps(entity, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def iter_snapshot(filename):
+    """Yield records from snapshot *filename*, one line at a time."""
+    with open(filename, 'r') as snapshot_file:
+        for line in snapshot_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Snapshot(object):
+    """Index of a previous snapshot, keeping only record ids and offsets.
+
+    Records are read back from disk on demand with :meth:`get_entity`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = {}
+        with open(filename, 'rb') as snapshot_file:
+            offset = snapshot_file.tell()
+            for line in iter(snapshot_file.readline, b''):
+                if line.strip():
+                    record = json.loads(line)
+                    self.records[(record['kind'], record['id'])] = (
+                        record['ids'],
+                        record['hash'],
+                        offset,
+                    )
+                offset = snapshot_file.tell()
+
+    def get_ids(self, kind, entity_id):
+        """Return signature recorded for *kind* with *entity_id*, or None."""
+        record = self.records.get((kind, entity_id))
+        return record[0] if record else None
+
+    def get_hash(self, kind, entity_id):
+        """Return content hash recorded for *kind* with *entity_id*, or None."""
+        record = self.records.get((kind, entity_id))
+        return record[1] if record else None
+
+    def get_entity(self, kind, entity_id):
+        """Return serialised entity recorded for *kind* with *entity_id*."""
+        with open(self.filename, 'rb') as snapshot_file:
+            snapshot_file.seek(self.records[(kind, entity_id)][2])
+            return json.loads(snapshot_file.readline())['entity']
+
+
+class EntityIndex(object):
+    """In-memory lookup of entities by id and by case-folded name."""
+
+    def __init__(self, entity_type):
+        self.entity_type = entity_type
+        self.by_id = {}
+        self.by_name = {}
+
+    def add(self, entity):
+        """Add *entity* to the index."""
+        self.by_id[entity['id']] = entity
+        self.by_name.setdefault(entity['name'].casefold(), entity)
+
+    def get(self, name):
+        """Return entity named *name*, ignoring case, or None."""
+        return self.by_name.get(name.casefold())
+
+    def load(self, session, attributes):
+        """Fill index from *session*, projecting *attributes*."""
+        for entity in session.query(
+            'select {0} from {1}'.format(', '.join(attributes), self.entity_type)
+        ):
+            self.add(entity)
+        return self
+
 
 class ManageProjectSchemas(object):
     def __init__(self):
@@ -34,23 +177,63 @@ class ManageProjectSchemas(object):
                 logger.info("setting log level debug on %s", log.name)
                 log.setLevel(logging.DEBUG)
 
-        # Cache up commonly used Ftrack entities
+        # Cache up commonly used Ftrack entities, projecting all attributes
+        # used when serialising or restoring so no lazy loads are needed.
         logger.info('Loading object types from Ftrack...')
-        self.object_types_by_id = {}
-        for object_type in self.session.query('select id from ObjectType'):
-            self.object_types_by_id[object_type['id']] = object_type
+        self.object_types = EntityIndex('ObjectType').load(
+            self.session,
+            [
+                'id',
+                'name',
+                'icon',
+                'is_leaf',
+                'is_schedulable',
+                'is_statusable',
+                'is_taskable',
+                'is_time_reportable',
+                'is_typeable',
+                'sort',
+            ],
+        )
+        self.object_types_by_id = self.object_types.by_id
+
+        logger.info('Loading states from Ftrack...')
+        self.states = EntityIndex('State').load(self.session, ['id', 'name', 'short'])
 
         logger.info('Loading statuses from Ftrack...')
-        self.status_types_by_id = {}
-        for status_type in self.session.query('select id from Status'):
-            self.status_types_by_id[status_type['id']] = status_type
+        self.statuses = EntityIndex('Status').load(
+            self.session,
+            ['id', 'name', 'color', 'is_active', 'sort', 'state.name', 'state.short'],
+        )
+        self.status_types_by_id = self.statuses.by_id
 
         logger.info('Loading types from Ftrack...')
-        self.types_by_id = {}
-        for t in self.session.query('select id from Type'):
-            self.types_by_id[t['id']] = t
+        self.types = EntityIndex('Type').load(
+            self.session, ['id', 'name', 'color', 'is_billable', 'sort']
+        )
+        self.types_by_id = self.types.by_id
+
+        # Number of server queries replaced by a lookup in the indexes above.
+        self.queries_avoided = 0
 
         self.result = dict(project_schemas=[], workflow_schemas=[], task_schemas=[])
+        # Serialised schemas in result, by id, to avoid adding them twice.
+        self.workflow_schemas_by_id = {}
+        self.task_schemas_by_id = {}
+
+        # Snapshot output and signatures of the schemas on the server, used
+        # when backing up to the line delimited format.
+        self.snapshot_file = None
+        self.previous = None
+        self.signatures = dict(project_schema={}, workflow_schema={}, task_schema={})
+        self.records_written = 0
+        self.records_reused = 0
+
+        # Records serialised by a backup worker, merged in afterwards.
+        self.collected = None
+        self._worker_sessions = []
+        self._worker_local = threading.local()
+        self._worker_lock = threading.Lock()
 
         if self.args.type == "backup":
             self.save_schemas()
@@ -102,6 +285,35 @@ class ManageProjectSchemas(object):
             help='(Used with --schema) The name to use when restoring a single schema.',
         )
 
+        self.parser.add_argument(
+            '--previous',
+            help=(
+                'Previous .jsonl snapshot. On backup, schemas which did not '
+                'change are copied from it rather than fetched. On verify, '
+                'the snapshot is compared to it.'
+            ),
+        )
+
+        self.parser.add_argument(
+            '--workers',
+            help='Number of project schemas backed up concurrently.',
+            type=int,
+            default=1,
+        )
+
+        self.parser.add_argument(
+            '--batch_size',
+            help='Number of entities committed at once during restore.',
+            type=int,
+            default=100,
+        )
+
+        self.parser.add_argument(
+            '--resume',
+            help='Resume an interrupted restore from its last committed batch.',
+            action='store_true'
+        )
+
         self.args = self.parser.parse_args()
 
         if self.filename is None and self.args.schema:
@@ -111,9 +323,13 @@ class ManageProjectSchemas(object):
 
     def get_add_workflow_schema(self, ft_workflow_schema):
         """Find workflow schema by ID, serialise and add if not there."""
-        for workflow_schema in self.result['workflow_schemas']:
-            if workflow_schema['id'] == ft_workflow_schema['id']:
-                return workflow_schema['id']
+        if ft_workflow_schema['id'] in self.workflow_schemas_by_id:
+            return ft_workflow_schema['id']
+        workflow_schema = self.reuse_record('workflow_schema', ft_workflow_schema['id'])
+        if workflow_schema is not None:
+            self.add_record('workflow_schema', workflow_schema['id'], workflow_schema)
+            self.workflow_schemas_by_id[workflow_schema['id']] = workflow_schema
+            return workflow_schema['id']
         workflow_schema = {
             'id': ft_workflow_schema['id'],
             'name': ft_workflow_schema['name'],
@@ -132,14 +348,19 @@ class ManageProjectSchemas(object):
                         continue
                     s[key] = ft_status[key]
             workflow_schema['statuses'].append(s)
-        self.result['workflow_schemas'].append(workflow_schema)
+        self.add_record('workflow_schema', workflow_schema['id'], workflow_schema)
+        self.workflow_schemas_by_id[workflow_schema['id']] = workflow_schema
         return workflow_schema['id']
 
     def get_add_task_schema(self, ft_task_schema):
         """Find task schema by ID, serialise and add if not there."""
-        for task_schema in self.result['task_schemas']:
-            if task_schema['id'] == ft_task_schema['id']:
-                return task_schema['id']
+        if ft_task_schema['id'] in self.task_schemas_by_id:
+            return ft_task_schema['id']
+        task_schema = self.reuse_record('task_schema', ft_task_schema['id'])
+        if task_schema is not None:
+            self.add_record('task_schema', task_schema['id'], task_schema)
+            self.task_schemas_by_id[task_schema['id']] = task_schema
+            return task_schema['id']
         task_schema = {
             'id': ft_task_schema['id'],
             'name': ft_task_schema['name'],
@@ -153,7 +374,8 @@ class ManageProjectSchemas(object):
                 if key in ft_type:
                     _type[key] = ft_type[key]
             task_schema['types'].append(_type)
-        self.result['task_schemas'].append(task_schema)
+        self.add_record('task_schema', task_schema['id'], task_schema)
+        self.task_schemas_by_id[task_schema['id']] = task_schema
         return task_schema['id']
 
     def save_object_types(self, ft_project_schema, project_schema):
@@ -306,51 +528,350 @@ class ManageProjectSchemas(object):
             ft_workflow_schema
         )
 
+    def get_signature(self, index, entity_id, to_dict):
+        """Return *entity_id* with a hash of its attributes from *index*.
+
+        Renaming a status, type or object type, or changing its color or
+        sort, keeps its id, so the serialised attributes are part of the
+        signature of the schemas referring to it.
+        """
+        entity = index.by_id.get(entity_id)
+        if entity is None:
+            return entity_id
+        return '{0}:{1}'.format(entity_id, get_content_hash(to_dict(entity)))
+
+    def load_signatures(self):
+        """Fetch signatures of all schemas, used to detect changed schemas.
+
+        Only ids and names are projected, the attributes of the statuses,
+        types and object types referred to are taken from the indexes, so
+        this is cheap compared to fetching and serialising the schemas
+        themselves.
+        """
+        logger.info('Loading schema signatures from Ftrack...')
+        status_signature = functools.partial(
+            self.get_signature, self.statuses, to_dict=self.ft_status_to_dict
+        )
+        type_signature = functools.partial(
+            self.get_signature, self.types, to_dict=self.ft_type_to_dict
+        )
+        object_type_signature = functools.partial(
+            self.get_signature, self.object_types, to_dict=self.ft_object_type_to_dict
+        )
+
+        for ft_workflow_schema in self.session.query(
+            'select id, name, statuses.id from WorkflowSchema'
+        ):
+            self.signatures['workflow_schema'][ft_workflow_schema['id']] = [
+                ft_workflow_schema['name']
+            ] + sorted(
+                status_signature(ft_status['id'])
+                for ft_status in ft_workflow_schema['statuses']
+            )
+
+        for ft_task_schema in self.session.query(
+            'select id, name, types.id from TaskTypeSchema'
+        ):
+            self.signatures['task_schema'][ft_task_schema['id']] = [
+                ft_task_schema['name']
+            ] + sorted(type_signature(ft_type['id']) for ft_type in ft_task_schema['types'])
+
+        for ft_project_schema in self.session.query(
+            'select id, name, task_workflow_schema_id, task_type_schema_id, '
+            'asset_version_workflow_schema_id, object_types.id, '
+            'object_type_schemas.id, object_type_schemas.type_id, '
+            'object_type_schemas.statuses.status_id, '
+            'object_type_schemas.types.type_id, task_templates.id, '
+            'task_templates.name, task_templates.items.task_type_id, '
+            'task_workflow_schema_overrides.type_id, '
+            'task_workflow_schema_overrides.workflow_schema_id from ProjectSchema'
+        ):
+            ids = [
+                ft_project_schema['name'],
+                ft_project_schema['task_workflow_schema_id'],
+                ft_project_schema['task_type_schema_id'],
+                ft_project_schema['asset_version_workflow_schema_id'],
+            ]
+            ids += sorted(
+                object_type_signature(x['id']) for x in ft_project_schema['object_types']
+            )
+            for ft_object_type_schema in sorted(
+                ft_project_schema['object_type_schemas'], key=lambda i: i['id']
+            ):
+                ids += [
+                    ft_object_type_schema['id'],
+                    object_type_signature(ft_object_type_schema['type_id']),
+                ]
+                ids += sorted(
+                    status_signature(x['status_id'])
+                    for x in ft_object_type_schema['statuses']
+                )
+                ids += sorted(
+                    type_signature(x['type_id']) for x in ft_object_type_schema['types']
+                )
+            for ft_task_template in sorted(
+                ft_project_schema['task_templates'], key=lambda i: i['id']
+            ):
+                ids += [ft_task_template['id'], ft_task_template['name']]
+                ids += sorted(
+                    type_signature(x['task_type_id']) for x in ft_task_template['items']
+                )
+            ids += sorted(
+                '{0}:{1}'.format(
+                    type_signature(x['type_id']), x['workflow_schema_id']
+                )
+                for x in ft_project_schema['task_workflow_schema_overrides']
+            )
+            self.signatures['project_schema'][ft_project_schema['id']] = ids
+
+    def is_unchanged(self, kind, entity_id):
+        """Return whether entity is unchanged since the previous snapshot."""
+        if self.previous is None:
+            return False
+        ids = self.previous.get_ids(kind, entity_id)
+        return ids is not None and ids == self.signatures[kind].get(entity_id)
+
+    def reuse_record(self, kind, entity_id):
+        """Return serialised entity from the previous snapshot, if unchanged.
+
+        Return None when there is no previous snapshot, or when the signature
+        of the entity changed since it was taken.
+        """
+        if not self.is_unchanged(kind, entity_id):
+            return None
+        self.records_reused += 1
+        return self.previous.get_entity(kind, entity_id)
+
+    def add_record(self, kind, entity_id, entity):
+        """Add serialised *entity* of *kind* to the backup.
+
+        When backing up to a snapshot the record is written straight away,
+        otherwise it is added to the result written at the end.
+        """
+        self.records_written += 1
+        if self.collected is not None:
+            self.collected.append((kind, entity_id, entity))
+            return
+
+        if self.snapshot_file is None:
+            self.result['{}s'.format(kind)].append(entity)
+            return
+
+        record = {
+            'kind': kind,
+            'id': entity_id,
+            'ids': self.signatures[kind].get(entity_id),
+            'hash': get_content_hash(entity),
+            'entity': entity,
+        }
+        self.snapshot_file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def reuse_project_schema(self, ft_project_schema):
+        """Add project schema from previous snapshot, if unchanged.
+
+        Return whether the project schema could be reused.
+        """
+        project_schema = self.reuse_record('project_schema', ft_project_schema['id'])
+        if project_schema is None:
+            return False
+
+        logger.info('{} unchanged, copying from previous snapshot...'.format(
+            ft_project_schema['name']
+        ))
+        # Make sure the schemas it refers to are part of the snapshot,
+        # in the same order as when serialising the project schema.
+        self.get_add_task_schema(
+            self.session.get('TaskTypeSchema', project_schema['task_type_schema'])
+        )
+        for workflow_schema_id in (
+            [project_schema['task_workflow_schema']]
+            + [
+                override['schema']
+                for override in project_schema['task_workflow_schema_overrides']
+            ]
+            + [project_schema['asset_version_workflow_schema']]
+        ):
+            self.get_add_workflow_schema(
+                self.session.get('WorkflowSchema', workflow_schema_id)
+            )
+        self.add_record('project_schema', ft_project_schema['id'], project_schema)
+        return True
+
+    def serialise_project_schema(self, ft_project_schema):
+        """Return serialised *ft_project_schema*.
+
+        Workflow and task schemas it refers to are added along the way.
+        """
+        logger.info('Backing up {}...'.format(ft_project_schema['name']))
+        project_schema = {
+            'name': ft_project_schema['name'],
+            'object_types': [],
+            'object_type_schemas': [],
+            'task_templates': [],
+            'task_type_schema': None,
+            'task_workflow_schema': None,
+            'task_workflow_schema_overrides': [],
+            'asset_version_workflow_schema': [],
+        }
+
+        # Collect and serialize schema definitions
+        for (key, fn) in list(
+            {
+                'object_types': self.save_object_types,
+                'object_type_schemas': self.save_object_type_schemas,
+                'task_templates': self.save_task_templates,
+                'task_type_schema': self.save_task_type_schema,
+                'task_workflow_schema': self.save_task_workflow_schema,
+                'task_workflow_schema_overrides': self.save_task_workflow_schema_overrides,
+                'save_asset_version_workflow_schema': self.save_asset_version_workflow_schema,
+            }.items()
+        ):
+            fn(ft_project_schema, project_schema)
+
+        return project_schema
+
+    def get_worker_session(self):
+        """Return session of the calling backup worker thread.
+
+        Worker sessions never lazy load, everything serialised has to be
+        projected explicitly.
+        """
+        session = getattr(self._worker_local, 'session', None)
+        if session is None:
+            session = ftrack_api.Session(
+                auto_populate=False, auto_connect_event_hub=False
+            )
+            self._worker_local.session = session
+            with self._worker_lock:
+                self._worker_sessions.append(session)
+        return session
+
+    def serialise_project_schema_in_worker(self, project_schema_id):
+        """Serialise project schema with *project_schema_id* in a worker.
+
+        Return the serialised project schema, the records of the schemas it
+        refers to in the order they were encountered and the number of
+        records reused from the previous snapshot.
+        """
+        session = self.get_worker_session()
+        ft_project_schema = session.query(
+            'select {0} from ProjectSchema where id is "{1}"'.format(
+                ', '.join(PROJECT_SCHEMA_PROJECTION), project_schema_id
+            )
+        ).one()
+
+        # Serialise with a copy of this instance sharing the caches, but
+        # collecting records instead of adding them to the backup.
+        serialiser = copy.copy(self)
+        serialiser.session = session
+        serialiser.workflow_schemas_by_id = {}
+        serialiser.task_schemas_by_id = {}
+        serialiser.collected = []
+        serialiser.records_reused = 0
+
+        project_schema = serialiser.serialise_project_schema(ft_project_schema)
+        return project_schema, serialiser.collected, serialiser.records_reused
+
+    def save_project_schemas_concurrently(self, ft_project_schemas):
+        """Serialise *ft_project_schemas* using a pool of workers.
+
+        Results are merged in the order of *ft_project_schemas*, so the
+        backup is identical to the one made by a single worker.
+        """
+        logger.info(
+            'Backing up {0} project schemas using {1} workers...'.format(
+                len(ft_project_schemas), self.args.workers
+            )
+        )
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.args.workers
+        )
+        try:
+            futures = {}
+            for ft_project_schema in ft_project_schemas:
+                if self.is_unchanged('project_schema', ft_project_schema['id']):
+                    # Reused in merge order below, nothing to fetch.
+                    continue
+                futures[ft_project_schema['id']] = executor.submit(
+                    self.serialise_project_schema_in_worker, ft_project_schema['id']
+                )
+
+            for ft_project_schema in ft_project_schemas:
+                future = futures.get(ft_project_schema['id'])
+                if future is None:
+                    self.reuse_project_schema(ft_project_schema)
+                    continue
+
+                project_schema, collected, records_reused = future.result()
+                self.records_reused += records_reused
+                for kind, entity_id, entity in collected:
+                    registry = (
+                        self.workflow_schemas_by_id
+                        if kind == 'workflow_schema'
+                        else self.task_schemas_by_id
+                    )
+                    if entity_id not in registry:
+                        self.add_record(kind, entity_id, entity)
+                        registry[entity_id] = entity
+                self.add_record('project_schema', ft_project_schema['id'], project_schema)
+        finally:
+            executor.shutdown(wait=True)
+            with self._worker_lock:
+                sessions, self._worker_sessions = self._worker_sessions, []
+            for session in sessions:
+                session.close()
+
     def save_schemas(self):
         """Read workflow schemas from Ftrack and write to JSON at disk."""
 
-        logger.info('Loading Workflow Schemas from Ftrack...')
-        workflow_schemas_by_id = {}
-        for workflow_schema in self.session.query('select id from WorkflowSchema'):
-            workflow_schemas_by_id[workflow_schema['id']] = workflow_schema
-
+        snapshot = is_snapshot(self.args.filename)
+        if snapshot:
+            self.load_signatures()
+            if self.args.previous:
+                logger.info('Loading previous snapshot {}...'.format(self.args.previous))
+                self.previous = Snapshot(self.args.previous)
+            if self.args.dry_run:
+                self.snapshot_file = io.StringIO()
+            else:
+                self.snapshot_file = open(self.args.filename + '.tmp', 'w')
+        elif self.args.workers <= 1:
+            # Prefetch all schemas along with the attributes serialised, so
+            # that no lazy loads happen while walking the project schemas.
+            logger.info('Loading Workflow Schemas from Ftrack...')
+            self.session.query(
+                'select id, name, statuses.id, statuses.name, statuses.color, '
+                'statuses.is_active, statuses.sort from WorkflowSchema'
+            ).all()
+
+            logger.info('Loading Task Type Schemas from Ftrack...')
+            self.session.query(
+                'select id, name, types.id, types.name, types.color, '
+                'types.is_billable, types.sort from TaskTypeSchema'
+            ).all()
+
+        ft_project_schemas = []
         logger.info('Backing up Ftrack project schemas...')
-        for ft_project_schema in self.session.query('select id from ProjectSchema'):
+        for ft_project_schema in self.session.query('select id, name from ProjectSchema'):
             if (
                 self.args.schema
                 and ft_project_schema['id'] != self.args.schema
                 and ft_project_schema['name'] != self.args.schema
             ):
                 continue
-            logger.info('Backing up {}...'.format(ft_project_schema['name']))
-            project_schema = {
-                'name': ft_project_schema['name'],
-                'object_types': [],
-                'object_type_schemas': [],
-                'task_templates': [],
-                'task_type_schema': None,
-                'task_workflow_schema': None,
-                'task_workflow_schema_overrides': [],
-                'asset_version_workflow_schema': [],
-            }
-
-            # Collect and serialize schema definitions
-            for (key, fn) in list(
-                {
-                    'object_types': self.save_object_types,
-                    'object_type_schemas': self.save_object_type_schemas,
-                    'task_templates': self.save_task_templates,
-                    'task_type_schema': self.save_task_type_schema,
-                    'task_workflow_schema': self.save_task_workflow_schema,
-                    'task_workflow_schema_overrides': self.save_task_workflow_schema_overrides,
-                    'save_asset_version_workflow_schema': self.save_asset_version_workflow_schema,
-                }.items()
-            ):
-                fn(ft_project_schema, project_schema)
+            ft_project_schemas.append(ft_project_schema)
 
-            self.result['project_schemas'].append(project_schema)
+        if self.args.workers > 1:
+            self.save_project_schemas_concurrently(ft_project_schemas)
+        else:
+            for ft_project_schema in ft_project_schemas:
+                if not self.reuse_project_schema(ft_project_schema):
+                    self.add_record(
+                        'project_schema',
+                        ft_project_schema['id'],
+                        self.serialise_project_schema(ft_project_schema),
+                    )
 
-        if len(self.result['project_schemas']) == 0:
+        if len(ft_project_schemas) == 0:
             if self.args.schema:
                 logger.warning(
                     'No schema with name/id "{}" were found!'.format(self.args.schema)
@@ -358,8 +879,26 @@ class ManageProjectSchemas(object):
             else:
                 logger.warning('No schemas were found!')
 
+        if snapshot:
+            if self.previous is not None:
+                logger.info(
+                    'Copied {0} of {1} records from previous snapshot.'.format(
+                        self.records_reused, self.records_written
+                    )
+                )
+            if not self.args.dry_run:
+                # Replace previous file only once the snapshot is complete.
+                self.snapshot_file.close()
+                os.replace(self.args.filename + '.tmp', self.args.filename)
+                logger.info('Wrote {}.'.format(self.args.filename))
+            else:
+                logger.warning(
+                    'Dry run, not writing snapshot {} to {}.'.format(
+                        self.snapshot_file.getvalue(), self.args.filename
+                    )
+                )
         # Nothing written to disk yet, save it unless it is a dry run.
-        if not self.args.dry_run:
+        elif not self.args.dry_run:
             logger.info('Writing {}...'.format(self.args.filename))
             json.dump(self.result, open(self.args.filename, 'w'))
         else:
@@ -369,32 +908,67 @@ class ManageProjectSchemas(object):
                 )
             )
 
+    def read_result(self, filename):
+        """Return backup *filename* as result, in either format."""
+        if not is_snapshot(filename):
+            return json.load(open(filename, 'r'))
+
+        result = dict(project_schemas=[], workflow_schemas=[], task_schemas=[])
+        for record in iter_snapshot(filename):
+            result['{}s'.format(record['kind'])].append(record['entity'])
+        return result
+
+    def diff_schemas(self):
+        """Compare snapshot with the previous one, one record at a time."""
+        logger.info(
+            'Comparing {0} with {1}...'.format(self.args.filename, self.args.previous)
+        )
+        previous = Snapshot(self.args.previous)
+        seen = set()
+        changes = 0
+        for record in iter_snapshot(self.args.filename):
+            key = (record['kind'], record['id'])
+            seen.add(key)
+            previous_hash = previous.get_hash(*key)
+            if previous_hash is None:
+                logger.info('+ {0} {1}'.format(record['kind'], record['entity']['name']))
+                changes += 1
+            elif previous_hash != record['hash']:
+                logger.info('~ {0} {1}'.format(record['kind'], record['entity']['name']))
+                changes += 1
+
+        for key in sorted(set(previous.records) - seen):
+            logger.info('- {0} {1}'.format(key[0], previous.get_entity(*key)['name']))
+            changes += 1
+
+        logger.info('{} difference(s) found.'.format(changes))
+
     def get_object_type(self, name):
         """Get Ftrack object type by name from pre-cached entries."""
-        for ft_object_type in list(self.object_types_by_id.values()):
-            if ft_object_type['name'].lower() == name.lower():
-                return ft_object_type
-        raise Exception(
-            'An unknown object type {} were encountered during restore!'.format(name)
-        )
+        ft_object_type = self.object_types.get(name)
+        if ft_object_type is None:
+            raise Exception(
+                'An unknown object type {} were encountered during restore!'.format(name)
+            )
+        return ft_object_type
 
     def get_status(self, name):
         """Get Ftrack status type by name from pre-cached entries."""
-        for ft_status in list(self.status_types_by_id.values()):
-            if ft_status['name'].lower() == name.lower():
-                return ft_status
-        raise Exception(
-            'An unknown status {} were encountered while during restore!'.format(name)
-        )
+        ft_status = self.statuses.get(name)
+        if ft_status is None:
+            raise Exception(
+                'An unknown status {} were encountered while during restore!'.format(name)
+            )
+        return ft_status
 
     def get_type(self, name):
         """Get Ftrack type by name from pre-cached entries."""
-        for ft_type in list(self.types_by_id.values()):
-            if ft_type['name'].lower() == name.lower():
-                return ft_type
-        raise Exception(
-            'An unknown type {} were encountered while during restore!'.format(name)
-        )
+        ft_type = self.types.get(name)
+        if ft_type is None:
+            raise Exception(
+                'An unknown type {} were encountered while during restore!'.format(name)
+            )
+        return ft_type
 
     def get_workflow_schema(self, prev_id):
         """Get workflow schema JSON from result."""
@@ -418,44 +992,83 @@ class ManageProjectSchemas(object):
             )
         )
 
-    def load_schemas(self):
-        """Load workflow schemas from JSON on disk and update Ftrack."""
+    def plan_create(self, plan, entity_type, data, depends=(), label=None):
+        """Add creation of *entity_type* with *data* to *plan*, return its key.
+
+        *depends* lists the keys of the planned entities which have to be
+        created first.
+        """
+        key = len(plan)
+        plan.append(
+            {
+                'key': key,
+                'entity_type': entity_type,
+                'data': data,
+                'depends': list(depends),
+                'label': label or entity_type,
+            }
+        )
+        return key
+
+    def plan_entity(self, plan, entity_type, data, depends=(), label=None):
+        """Plan creation of an entity referenced by others.
+
+        Its id is generated up front so dependent entities can refer to it,
+        return a dict holding the *id* and plan *key*.
+        """
+        data = dict(data, id=str(uuid.uuid4()))
+        key = self.plan_create(plan, entity_type, data, depends, label)
+        return {'id': data['id'], 'key': key}
 
-        self.result = json.load(open(self.args.filename, 'r'))
+    def plan_schemas(self):
+        """Return list of entity creations restoring the loaded schemas."""
+        plan = []
 
-        logger.info('Creating workflow schemas...')
-        ft_workflow_schemas = []
+        logger.info('Planning workflow schemas...')
         for workflow_schema in self.result.get('workflow_schemas'):
-            ft_workflow_schema = self.session.create(
-                'WorkflowSchema', {'name': workflow_schema['name']}
+            ft_workflow_schema = self.plan_entity(
+                plan,
+                'WorkflowSchema',
+                {'name': workflow_schema['name']},
+                label='WorkflowSchema {}'.format(workflow_schema['name']),
             )
             workflow_schema['entity'] = ft_workflow_schema
             for status in workflow_schema['statuses']:
-                self.session.create(
+                self.plan_create(
+                    plan,
                     'WorkflowSchemaStatus',
                     {
                         'workflow_schema_id': ft_workflow_schema['id'],
                         'status_id': self.get_status(status['name'])['id'],
                     },
+                    depends=[ft_workflow_schema['key']],
+                    label='WorkflowSchemaStatus {0}/{1}'.format(
+                        workflow_schema['name'], status['name']
+                    ),
                 )
-            ft_workflow_schemas.append(ft_workflow_schema)
 
-        logger.info('Creating task type schemas...')
-        ft_task_type_schemas = []
+        logger.info('Planning task type schemas...')
         for task_schema in self.result.get('task_schemas'):
-            ft_task_schema = self.session.create(
-                'TaskTypeSchema', {'name': task_schema['name']}
+            ft_task_schema = self.plan_entity(
+                plan,
+                'TaskTypeSchema',
+                {'name': task_schema['name']},
+                label='TaskTypeSchema {}'.format(task_schema['name']),
             )
             task_schema['entity'] = ft_task_schema
             for _type in task_schema['types']:
-                self.session.create(
+                self.plan_create(
+                    plan,
                     'TaskTypeSchemaType',
                     {
                         'task_type_schema_id': ft_task_schema['id'],
                         'type_id': self.get_type(_type['name'])['id'],
                     },
+                    depends=[ft_task_schema['key']],
+                    label='TaskTypeSchemaType {0}/{1}'.format(
+                        task_schema['name'], _type['name']
+                    ),
                 )
-            ft_task_type_schemas.append(ft_task_schema)
 
         schema_found = False
         for project_schema in self.result['project_schemas']:
@@ -467,31 +1080,41 @@ class ManageProjectSchemas(object):
                 if self.args.schema is not None and self.args.destination is not None
                 else project_schema['name']
             )
-            ft_project_schema = self.session.create(
+            task_workflow_schema = self.get_workflow_schema(
+                project_schema['task_workflow_schema']
+            )
+            task_type_schema = self.get_task_schema(project_schema['task_type_schema'])
+            asset_version_workflow_schema = self.get_workflow_schema(
+                project_schema['asset_version_workflow_schema']
+            )
+            ft_project_schema = self.plan_entity(
+                plan,
                 'ProjectSchema',
                 {
                     'name': new_name,
-                    'task_workflow_schema_id': self.get_workflow_schema(
-                        project_schema['task_workflow_schema']
-                    )['id'],
-                    'task_type_schema_id': self.get_task_schema(
-                        project_schema['task_type_schema']
-                    )['id'],
-                    'asset_version_workflow_schema_id': self.get_workflow_schema(
-                        project_schema['asset_version_workflow_schema']
-                    )['id'],
+                    'task_workflow_schema_id': task_workflow_schema['id'],
+                    'task_type_schema_id': task_type_schema['id'],
+                    'asset_version_workflow_schema_id': asset_version_workflow_schema[
+                        'id'
+                    ],
                 },
+                depends=[
+                    task_workflow_schema['key'],
+                    task_type_schema['key'],
+                    asset_version_workflow_schema['key'],
+                ],
+                label='ProjectSchema {}'.format(new_name),
             )
             logger.info(
                 (0 * ' ')
-                + 'Created project schema {0}({1})...'.format(
+                + 'Planned project schema {0}({1})...'.format(
                     new_name, project_schema['name']
                 )
             )
 
             # Deserialize and store definitions for schema
             # Note that milestone and task already gets created with the schema
-            logger.info((4 * ' ') + 'Restoring object_types(Objects)...')
+            logger.info((4 * ' ') + 'Planning object_types(Objects)...')
             for object_type in project_schema['object_types']:
                 if object_type['name'].lower() == 'task':
                     continue
@@ -499,9 +1122,7 @@ class ManageProjectSchemas(object):
                 if object_type['name'].lower() != 'milestone':
                     project_schema_object_type = {
                         'project_schema_id': ft_project_schema['id'],
-                        'object_type_id': self.get_object_type(object_type['name'])[
-                            'id'
-                        ],
+                        'object_type_id': ft_object_type['id'],
                     }
                     for key in [
                         'icon',
@@ -515,12 +1136,18 @@ class ManageProjectSchemas(object):
                     ]:
                         if key in object_type:
                             project_schema_object_type[key] = object_type[key]
-                    self.session.create(
-                        'ProjectSchemaObjectType', project_schema_object_type
+                    self.plan_create(
+                        plan,
+                        'ProjectSchemaObjectType',
+                        project_schema_object_type,
+                        depends=[ft_project_schema['key']],
+                        label='ProjectSchemaObjectType {0}/{1}'.format(
+                            new_name, object_type['name']
+                        ),
                     )
                     logger.info(
                         (8 * ' ')
-                        + 'Created schema for object type {}, restoring schema for type...'.format(
+                        + 'Planned schema for object type {}, restoring schema for type...'.format(
                             object_type['name']
                         )
                     )
@@ -536,17 +1163,22 @@ class ManageProjectSchemas(object):
                         continue
 
                     # Create the schema
-                    ft_object_type_schema = self.session.create(
+                    ft_object_type_schema = self.plan_entity(
+                        plan,
                         'Schema',
                         {
                             'project_schema_id': ft_project_schema['id'],
                             'object_type_id': ft_object_type['id'],
                         },
+                        depends=[ft_project_schema['key']],
+                        label='Schema {0}/{1}'.format(
+                            new_name, ft_object_type['name']
+                        ),
                     )
 
                     logger.info(
                         (12 * ' ')
-                        + 'Created schema for {0}, mapping statuses: {1} and types: {2}...'.format(
+                        + 'Planned schema for {0}, mapping statuses: {1} and types: {2}...'.format(
                             ft_object_type['name'],
                             object_type_schema['statuses'],
                             object_type_schema['types'],
@@ -556,69 +1188,101 @@ class ManageProjectSchemas(object):
                     # Restore its types
                     for type_dict in object_type_schema['types']:
                         type_name = type_dict['name']
-                        self.session.create('SchemaType', {
-                            'schema_id': ft_object_type_schema['id'],
-                            'type_id': self.get_type(type_name)['id']
-                        })
+                        self.plan_create(
+                            plan,
+                            'SchemaType',
+                            {
+                                'schema_id': ft_object_type_schema['id'],
+                                'type_id': self.get_type(type_name)['id'],
+                            },
+                            depends=[ft_object_type_schema['key']],
+                            label='SchemaType {0}/{1}/{2}'.format(
+                                new_name, ft_object_type['name'], type_name
+                            ),
+                        )
                         logger.info((16 * ' ') + '+ Type: {}'.format(type_name))
 
                     # And statuses
                     for status_dict in object_type_schema['statuses']:
                         status_name = status_dict['name']
-                        self.session.create('SchemaStatus', {
-                            'schema_id': ft_object_type_schema['id'],
-                            'status_id': self.get_status(status_name)['id']
-                        })
+                        self.plan_create(
+                            plan,
+                            'SchemaStatus',
+                            {
+                                'schema_id': ft_object_type_schema['id'],
+                                'status_id': self.get_status(status_name)['id'],
+                            },
+                            depends=[ft_object_type_schema['key']],
+                            label='SchemaStatus {0}/{1}/{2}'.format(
+                                new_name, ft_object_type['name'], status_name
+                            ),
+                        )
                         logger.info((16 * ' ') + '+ Status: {}'.format(status_name))
 
             # Restore overrides
             logger.info(
                 (4 * ' ')
-                + 'Restoring task_workflow_schema_overrides(Task workflow, part of)...'
+                + 'Planning task_workflow_schema_overrides(Task workflow, part of)...'
             )
             for task_workflow_schema_override in project_schema[
                 'task_workflow_schema_overrides'
             ]:
                 ft_task_type = self.get_type(task_workflow_schema_override['type'])
-                self.session.create(
+                override_workflow_schema = self.get_workflow_schema(
+                    task_workflow_schema_override['schema']
+                )
+                self.plan_create(
+                    plan,
                     'ProjectSchemaOverride',
                     {
                         'project_schema_id': ft_project_schema['id'],
                         'type_id': ft_task_type['id'],
-                        'workflow_schema_id': self.get_workflow_schema(
-                            task_workflow_schema_override['schema']
-                        )['id'],
+                        'workflow_schema_id': override_workflow_schema['id'],
                     },
+                    depends=[ft_project_schema['key'], override_workflow_schema['key']],
+                    label='ProjectSchemaOverride {0}/{1}'.format(
+                        new_name, ft_task_type['name']
+                    ),
                 )
                 logger.info(
                     (8 * ' ')
-                    + 'Created override for type {0}...'.format(ft_task_type['name'])
+                    + 'Planned override for type {0}...'.format(ft_task_type['name'])
                 )
 
             # Restore task templates and their types
-            logger.info((4 * ' ') + 'Restoring task_templates(Task templates)...')
+            logger.info((4 * ' ') + 'Planning task_templates(Task templates)...')
             for task_template in project_schema['task_templates']:
-                ft_task_template = self.session.create(
+                ft_task_template = self.plan_entity(
+                    plan,
                     'TaskTemplate',
                     {
                         'project_schema_id': ft_project_schema['id'],
                         'name': task_template['name'],
                     },
+                    depends=[ft_project_schema['key']],
+                    label='TaskTemplate {0}/{1}'.format(
+                        new_name, task_template['name']
+                    ),
                 )
                 logger.info(
                     (8 * ' ')
-                    + 'Created task template {0}, adding types: {1}...'.format(
-                        ft_task_template['name'], task_template['items']
+                    + 'Planned task template {0}, adding types: {1}...'.format(
+                        task_template['name'], task_template['items']
                     )
                 )
 
                 for task_type_name in task_template['items']:
-                    self.session.create(
+                    self.plan_create(
+                        plan,
                         'TaskTemplateItem',
                         {
                             'template_id': ft_task_template['id'],
                             'task_type_id': self.get_type(task_type_name)['id'],
                         },
+                        depends=[ft_task_template['key']],
+                        label='TaskTemplateItem {0}/{1}/{2}'.format(
+                            new_name, task_template['name'], task_type_name
+                        ),
                     )
                     logger.info((12 * ' ') + '+ Task type: {}'.format(task_type_name))
 
@@ -630,13 +1294,130 @@ class ManageProjectSchemas(object):
             else:
                 logger.warning('No schemas were found/JSON empty!')
 
-        # No changes has been made yet, commit to Ftrack unless dry run
-        if not self.args.dry_run:
-            logger.info('Committing Project Schemas to Ftrack...')
+        return plan
+
+    def sort_plan(self, plan):
+        """Return *plan* sorted so entities come after their dependencies.
+
+        Entities are grouped by depth in the dependency graph, keeping the
+        planned order within a depth.
+        """
+        depths = {}
+        remaining = list(plan)
+        while remaining:
+            pending = []
+            for item in remaining:
+                if all(key in depths for key in item['depends']):
+                    depths[item['key']] = 1 + max(
+                        [depths[key] for key in item['depends']] or [-1]
+                    )
+                else:
+                    pending.append(item)
+
+            if len(pending) == len(remaining):
+                raise Exception(
+                    'Cyclic or missing dependencies in restore plan: {}'.format(
+                        ', '.join(item['label'] for item in pending)
+                    )
+                )
+            remaining = pending
+
+        return sorted(plan, key=lambda item: (depths[item['key']], item['key']))
+
+    def get_restore_state_path(self):
+        """Return path of the file tracking restore progress."""
+        return '{}.restore'.format(self.args.filename)
+
+    def write_restore_state(self, state):
+        """Write restore *state* to disk, replacing the previous one."""
+        path = self.get_restore_state_path()
+        json.dump(state, open(path + '.tmp', 'w'))
+        os.replace(path + '.tmp', path)
+
+    def commit_plan(self, state):
+        """Create and commit entities from restore *state* in batches.
+
+        The number of committed entities is saved after each batch so that a
+        failed restore can be resumed with --resume, possibly using another
+        batch size.
+        """
+        plan = self.sort_plan(state['plan'])
+        batch_size = max(1, self.args.batch_size)
+        batch_count = state['committed'] // batch_size + (
+            len(plan) - state['committed'] + batch_size - 1
+        ) // batch_size
+
+        if state['committed']:
+            logger.info(
+                'Resuming restore after {0} of {1} entities...'.format(
+                    state['committed'], len(plan)
+                )
+            )
+
+        total_start = time.time()
+        for offset in range(state['committed'], len(plan), batch_size):
+            batch = plan[offset:offset + batch_size]
+            batch_number = offset // batch_size + 1
+            start = time.time()
+            for item in batch:
+                self.session.create(item['entity_type'], item['data'])
+
             try:
                 self.session.commit()
             except Exception as error:
+                self.session.rollback()
+                logger.error(
+                    'Failed to commit batch {0} of {1}, containing:\n{2}'.format(
+                        batch_number,
+                        batch_count,
+                        '\n'.join((4 * ' ') + item['label'] for item in batch),
+                    )
+                )
                 logger.error(error, exc_info=True)
+                logger.error(
+                    'Fix the problem and run again with --resume to continue, '
+                    'use --batch_size 1 to single out the failing entity.'
+                )
+                return False
+
+            state['committed'] = offset + len(batch)
+            self.write_restore_state(state)
+            logger.info(
+                'Committed batch {0} of {1} ({2} entities) in {3:.2f}s.'.format(
+                    batch_number, batch_count, len(batch), time.time() - start
+                )
+            )
+
+        logger.info(
+            'Committed {0} entities in {1:.2f}s.'.format(
+                len(plan), time.time() - total_start
+            )
+        )
+        return True
+
+    def load_schemas(self):
+        """Load workflow schemas from JSON on disk and update Ftrack."""
+
+        state_path = self.get_restore_state_path()
+        if self.args.resume and os.path.isfile(state_path):
+            logger.info('Loading restore state from {}...'.format(state_path))
+            state = json.load(open(state_path, 'r'))
+        else:
+            self.result = self.read_result(self.args.filename)
+            state = {'plan': self.plan_schemas(), 'committed': 0}
+
+        # No changes has been made yet, commit to Ftrack unless dry run
+        if not self.args.dry_run:
+            logger.info(
+                'Committing {0} Project Schema entities to Ftrack...'.format(
+                    len(state['plan'])
+                )
+            )
+            if state['committed'] == 0:
+                self.write_restore_state(state)
+
+            if self.commit_plan(state):
+                os.remove(state_path)
         else:
             logger.warning('Dry run, NOT committing Project Schemas to Ftrack based on JSON {}...'.format(
                 self.result
@@ -651,17 +1432,19 @@ class ManageProjectSchemas(object):
             "sort": 12
         },
         """
-        ft_status = None
-        try:
-            ft_status = self.session.query('Status where name is "{}"'.format(status['name'].lower())).one()
-
-        except Exception as e:
-            logger.debug(e, exc_info=e)
-            if not self.args.dry_run:
-                ft_state = self.session.query('State where name is "{}"'.format(
-                    status['state']['name'])).one()
-                status['state'] = ft_state
-                ft_status = self.session.create('Status', status)
+        self.queries_avoided += 1
+        ft_status = self.statuses.get(status['name'])
+        if ft_status is None and not self.args.dry_run:
+            self.queries_avoided += 1
+            ft_state = self.states.get(status['state']['name'])
+            if ft_state is None:
+                raise Exception(
+                    'An unknown state {} were encountered during verify!'.format(
+                        status['state']['name']
+                    )
+                )
+            ft_status = self.session.create('Status', dict(status, state=ft_state))
+            self.statuses.add(ft_status)
 
         return ft_status
 
@@ -674,13 +1457,11 @@ class ManageProjectSchemas(object):
                     "sort": 0
                 },
         """
-        ft_type = None
-        try:
-            ft_type = self.session.query('Type where name is "{}"'.format(_type['name'].lower())).one()
-        except Exception as e:
-            logger.debug(e, exc_info=e)
-            if not self.args.dry_run:
-                ft_type = self.session.create('Type', _type)
+        self.queries_avoided += 1
+        ft_type = self.types.get(_type['name'])
+        if ft_type is None and not self.args.dry_run:
+            ft_type = self.session.create('Type', _type)
+            self.types.add(ft_type)
         return ft_type
 
     def ensure_object_types(self, object_type):
@@ -697,19 +1478,21 @@ class ManageProjectSchemas(object):
                     "sort": 13
                 }
         """
-        ft_object_type = None
-        try:
-            ft_object_type = self.session.query('ObjectType where name is "{}"'.format(object_type['name'].lower())).one()
-        except Exception as e:
-            logger.debug(e, exc_info=e)
-            if not self.args.dry_run:
-                ft_object_type = self.session.create('ObjectType', object_type)
+        self.queries_avoided += 1
+        ft_object_type = self.object_types.get(object_type['name'])
+        if ft_object_type is None and not self.args.dry_run:
+            ft_object_type = self.session.create('ObjectType', object_type)
+            self.object_types.add(ft_object_type)
         return ft_object_type
 
     def verify_schemas(self):
         """ Load workflow schemas from JSON on disk and update Ftrack. """
 
-        self.result = json.load(open(self.args.filename, 'r'))
+        if self.args.previous:
+            self.diff_schemas()
+            return
+
+        self.result = self.read_result(self.args.filename)
 
         logger.info('Checking statuses...')
 
@@ -717,27 +1500,27 @@ class ManageProjectSchemas(object):
         self.missing_types = []
         self.missing_object_types = []
 
-        status_cache = []
+        status_cache = set()
         for workflow_schema in self.result.get('workflow_schemas'):
             for status in workflow_schema['statuses']:
                 if status['name'] not in status_cache:
                     st = self.ensure_status(status)
-                    status_cache.append(status['name'])
+                    status_cache.add(status['name'])
                     if not st:
                         self.missing_status.append(status['name'])
 
         logger.info('Checking types...')
 
-        _type_cache = []
+        _type_cache = set()
         for task_schema in self.result.get('task_schemas'):
             for _type in task_schema['types']:
                 if _type['name'] not in _type_cache:
                     tp = self.ensure_types(_type)
-                    _type_cache.append(_type['name'])
+                    _type_cache.add(_type['name'])
                     if not tp:
                         self.missing_types.append(_type['name'])
 
-        object_type_cache = []
+        object_type_cache = set()
         logger.info('Checking object types...')
         for project_schema in self.result['project_schemas']:
             for object_type in project_schema['object_types']:
@@ -745,7 +1528,7 @@ class ManageProjectSchemas(object):
                     continue
                 if not object_type['name'] in object_type_cache:
                     ft_object_type = self.ensure_object_types(object_type)
-                    object_type_cache.append(object_type['name'])
+                    object_type_cache.add(object_type['name'])
                     if not ft_object_type:
                         self.missing_object_types.append(object_type['name'])
             for object_type_schemas in project_schema['object_type_schemas']:
@@ -765,7 +1548,7 @@ class ManageProjectSchemas(object):
                     for status in statuses:
                         if status['name'] not in status_cache:
                             new_status = self.ensure_status(status)
-                            status_cache.append(status['name'])
+                            status_cache.add(status['name'])
                             if not new_status:
                                 self.missing_status.append(status['name'])
                 _types = object_type_schemas['types']
@@ -773,7 +1556,7 @@ class ManageProjectSchemas(object):
                     for t in _types:
                         if t['name'] not in _type_cache:
                             new_type = self.ensure_types(t)
-                            _type_cache.append(t['name'])
+                            _type_cache.add(t['name'])
                             if not new_type:
                                 self.missing_types.append(t['name'])
 
@@ -792,6 +1575,11 @@ class ManageProjectSchemas(object):
             for s in sorted(list(set(self.missing_object_types))):
                 logger.info(s)
 
+        logger.info(
+            'Resolved {} lookups from local indexes instead of querying '
+            'Ftrack.'.format(self.queries_avoided)
+        )
+
         # No changes has been made yet, commit to Ftrack unless dry run
         if not self.args.dry_run:
             logger.info('Committing Project Schemas to Ftrack...')
@@ -9,13 +9,23 @@ import time
 import logging
 import shutil
 import psutil
-import glob
 import re
 import json
-
+import hashlib
+import sqlite3
+import signal
+import threading
+import collections
+import concurrent.futures
+
+from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
+try:
+    from watchdog.observers.inotify import InotifyObserver
+except ImportError:
+    # Only available on Linux
+    InotifyObserver = None
 from watchdog.events import FileSystemEventHandler
-from watchdog.events import FileCreatedEvent
 
 import ftrack_api
 
@@ -42,12 +52,55 @@ default_regex = os.environ.get(
     '(?P<project>[a-zA-Z0-9-].+)(?:[_])(?P<shot>[a-zA-Z0-9-].+)(?:[_])(?P<task>[a-zA-Z0-9-].+)(?:[_])(?:[v](?P<version>[\d]+))'
 )
 
+# Optional JSON file listing more file name patterns, tried in order before the
+# default one, eg. [{"name": "vendor", "regex": "...", "prefix": "VND_",
+# "extensions": [".mov"]}]
+patterns_path = os.environ.get('FTRACK_VERSION_WATCHFOLDER_PATTERNS')
+
 # Task status for upload
 task_status = 'In Progress'
 
 # Upload asset type
 asset_type = "Upload"
 
+# Use the polling observer instead of the native one (inotify on Linux), eg. for
+# network shares which do not report changes made by other hosts
+use_polling = os.environ.get('FTRACK_VERSION_WATCHFOLDER_POLLING') == '1'
+
+# Seconds the size and modification time of a file must stay unchanged before
+# it is considered to have finished copying
+settle_time = float(os.environ.get('FTRACK_VERSION_WATCHFOLDER_SETTLE', 3))
+
+# Also wait for no process to have the file open, which walks every open file
+# of every process, before uploading it
+check_handles = os.environ.get('FTRACK_VERSION_WATCHFOLDER_CHECK_HANDLES') == '1'
+
+# Number of files uploaded concurrently
+upload_workers = int(os.environ.get('FTRACK_VERSION_WATCHFOLDER_WORKERS', 4))
+
+# Maximum number of settled files waiting for an upload worker, past which new
+# files are left waiting in the folder
+queue_size = int(os.environ.get('FTRACK_VERSION_WATCHFOLDER_QUEUE_SIZE', 100))
+
+# Seconds to wait for more files once one is ready, to create the versions of
+# files arriving together in one commit and update them in another, 0 to
+# upload each file on its own
+batch_window = float(os.environ.get('FTRACK_VERSION_WATCHFOLDER_BATCH_WINDOW', 0))
+
+# Maximum number of files committed together
+batch_size = int(os.environ.get('FTRACK_VERSION_WATCHFOLDER_BATCH_SIZE', 50))
+
+# Seconds task, asset type and status lookups are cached for
+cache_ttl = float(os.environ.get('FTRACK_VERSION_WATCHFOLDER_CACHE_TTL', 300))
+
+# SQLite ledger recording the state of every file ingested
+ledger_path = os.environ.get(
+    'FTRACK_VERSION_WATCHFOLDER_LEDGER',
+    os.path.join(watch_folder or '', '.ingest_ledger.sqlite')
+)
+
+# Files to upload
+movie_regex = re.compile(r".*\.(mov|qt|mp4)$", re.IGNORECASE)
 
 
 if not any([ftrack_server, ftrack_api_key, ftrack_api_user]):
@@ -61,6 +114,284 @@ if not watch_folder:
     raise ValueError(msg)
 
 
+class TTLCache(object):
+    # Thread safe mapping whose entries expire `ttl` seconds after being set
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+
+
+# Task ids by (project, shot, task) names, and asset type and status ids by
+# query, shared by all upload workers
+task_cache = TTLCache(cache_ttl)
+entity_cache = TTLCache(cache_ttl)
+
+# Each upload worker keeps its own session, sessions are not thread safe
+thread_data = threading.local()
+
+# Sessions of all threads, closed on shutdown along with the threads of the
+# encode executor
+sessions = []
+sessions_lock = threading.Lock()
+
+
+def get_session():
+    # Long lived session of the current thread, created on first use
+    session = getattr(thread_data, 'session', None)
+    if session is None:
+        session = thread_data.session = ftrack_api.Session()
+        with sessions_lock:
+            sessions.append(session)
+    return session
+
+
+def close_session():
+    session = getattr(thread_data, 'session', None)
+    if session is not None:
+        session.close()
+        thread_data.session = None
+        with sessions_lock:
+            sessions.remove(session)
+
+
+def close_all_sessions():
+    # Close the sessions left open by threads, once they stopped
+    with sessions_lock:
+        for session in sessions:
+            session.close()
+        del sessions[:]
+
+
+def get_cached_entity(session, entity_type, criteria):
+    # Entity matching `criteria`, looked up in the session cache by id while
+    # the id is cached
+    key = (entity_type, criteria)
+    entity_id = entity_cache.get(key)
+    if entity_id is not None:
+        return session.get(entity_type, entity_id)
+
+    entity = session.query(f'{entity_type} where {criteria}').first()
+    if entity is not None:
+        entity_cache.set(key, entity['id'])
+    return entity
+
+
+class IngestLedger(object):
+    # Files seen by the watcher, by path, with their size, modification time,
+    # content hash, upload state, the resulting AssetVersion id and the id of
+    # its source component. States are: uploading, encoded (media encoded,
+    # component and task not updated yet), uploaded (not moved to done yet),
+    # done and duplicate.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                'hash TEXT, state TEXT, asset_version_id TEXT, updated REAL)'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS files_hash ON files (hash)'
+            )
+
+            # Ledgers created by earlier versions lack the component id
+            columns = [
+                row[1] for row in self._connection.execute('PRAGMA table_info(files)')
+            ]
+            if 'component_id' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE files ADD COLUMN component_id TEXT'
+                )
+
+    def get(self, path):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT path, size, mtime, hash, state, asset_version_id, '
+                'component_id FROM files WHERE path = ?', (path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(
+            (
+                'path', 'size', 'mtime', 'hash', 'state', 'asset_version_id',
+                'component_id',
+            ),
+            row
+        ))
+
+    def find_uploaded(self, content_hash):
+        # Path of a file with this content already uploaded, None otherwise
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT path FROM files WHERE hash = ? AND state IN (?, ?) '
+                'LIMIT 1', (content_hash, 'uploaded', 'done')
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(
+        self, path, size, mtime, content_hash, state, asset_version_id=None,
+        component_id=None
+    ):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime, hash, state, '
+                'asset_version_id, component_id, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    path, size, mtime, content_hash, state, asset_version_id,
+                    component_id, time.time()
+                )
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def get_file_hash(fpath, chunk_size=1024 * 1024):
+    # SHA1 of the file content
+    file_hash = hashlib.sha1()
+    with open(fpath, 'rb') as file_object:
+        for chunk in iter(lambda: file_object.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_signature(fpath):
+    # Size and modification time of the file, None if it does not exist
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FilenamePattern(object):
+    # Named file name pattern, compiled once. The optional prefix and
+    # extensions are checked first, as they are cheaper than the regex.
+
+    required_groups = ('project', 'shot', 'task')
+
+    def __init__(self, name, regex, prefix=None, extensions=None):
+        self.name = name
+        self.regex = re.compile(regex, re.IGNORECASE)
+        self.prefix = prefix.lower() if prefix else None
+        self.extensions = tuple(
+            extension.lower() for extension in extensions
+        ) if extensions else None
+
+        missing = set(self.required_groups) - set(self.regex.groupindex)
+        if missing:
+            raise ValueError(
+                f'Pattern {name} is missing groups {", ".join(sorted(missing))}'
+            )
+
+    def match(self, file_name):
+        # Parsed groups, or the reason why the name does not match
+        lower_name = file_name.lower()
+        if self.prefix and not lower_name.startswith(self.prefix):
+            return None, f'{self.name}: does not start with {self.prefix}'
+
+        if self.extensions and not lower_name.endswith(self.extensions):
+            return None, f'{self.name}: extension not in {", ".join(self.extensions)}'
+
+        match = self.regex.match(file_name)
+        if not match:
+            return None, f'{self.name}: does not match {self.regex.pattern}'
+
+        return match.groupdict(), None
+
+
+class FilenameParser(object):
+    # Ordered registry of file name patterns, the first one matching wins.
+    # Counts the names parsed by each pattern and the names rejected.
+
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self.hits = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, pattern):
+        self.patterns.append(pattern)
+
+    def parse(self, file_name, count=True):
+        # Return the name of the matching pattern and the parsed groups, raise
+        # a ValueError listing why each pattern rejected the name otherwise
+        reasons = []
+        for pattern in self.patterns:
+            groups, reason = pattern.match(file_name)
+            if groups is not None:
+                if count:
+                    with self._lock:
+                        self.hits[pattern.name] += 1
+                return pattern.name, groups
+            reasons.append(reason)
+
+        if count:
+            with self._lock:
+                self.hits[None] += 1
+        raise ValueError(
+            f'Could not extract value from : {file_name} ({"; ".join(reasons)})'
+        )
+
+    def report(self):
+        with self._lock:
+            hits = dict(self.hits)
+        rejected = hits.pop(None, 0)
+        return ', '.join(
+            [f'{pattern.name}: {hits.get(pattern.name, 0)}' for pattern in self.patterns]
+            + [f'rejected: {rejected}']
+        )
+
+
+def load_parser():
+    parser = FilenameParser()
+    if patterns_path:
+        with open(patterns_path) as patterns_file:
+            for options in json.load(patterns_file):
+                parser.add(FilenamePattern(**options))
+    parser.add(FilenamePattern('default', default_regex))
+    logger.info(
+        f'Parsing file names with patterns: {", ".join(pattern.name for pattern in parser.patterns)}'
+    )
+    return parser
+
+
+filename_parser = load_parser()
+
+
+def get_project(fpath):
+    # Project name parsed from the file name, None if it does not match
+    try:
+        name, groups = filename_parser.parse(os.path.basename(fpath), count=False)
+    except ValueError:
+        return None
+    return groups.get('project')
+
+
 def has_handle(fpath):
     # Check if the file is open somewhere
     for proc in psutil.process_iter():
@@ -73,29 +404,166 @@ def has_handle(fpath):
     return False
 
 
+class UploadQueue(object):
+    # Bounded queue of files to upload, served in turn across projects so a
+    # large drop for one project does not hold back the others. Files found
+    # by the startup scan are only served once no live file is waiting, and
+    # only they count towards the bound, so a backlog never blocks live files
+    # for long.
+
+    LIVE = 0
+    BACKLOG = 1
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._queues = (collections.OrderedDict(), collections.OrderedDict())
+        self._sizes = [0, 0]
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return sum(self._sizes)
+
+    def _is_full(self, priority):
+        if priority == self.LIVE:
+            return self._sizes[self.LIVE] >= self.maxsize
+        return len(self) >= self.maxsize
+
+    def put(self, project, file_path, priority=LIVE):
+        # Block while the queue is full, return False once it is closed
+        with self._condition:
+            if self._is_full(priority):
+                logger.warning(
+                    f'Upload queue full ({len(self)} files), waiting for uploads to finish...'
+                )
+            while self._is_full(priority) and not self._closed:
+                self._condition.wait()
+
+            if self._closed:
+                return False
+
+            queues = self._queues[priority]
+            queues.setdefault(project, collections.deque()).append(file_path)
+            self._sizes[priority] += 1
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        # Block until a file is queued, return None once the queue is closed
+        # or after `timeout` seconds
+        with self._condition:
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while not len(self) and not self._closed:
+                if timeout is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+            if self._closed:
+                return None
+
+            priority = self.LIVE if self._sizes[self.LIVE] else self.BACKLOG
+            queues = self._queues[priority]
+
+            # Take from the first project in line, then move it to the back
+            project, files = next(iter(queues.items()))
+            file_path = files.popleft()
+            del queues[project]
+            if files:
+                queues[project] = files
+
+            self._sizes[priority] -= 1
+            self._condition.notify_all()
+            return file_path
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
 class Watcher(object):
     watch_folder = None
-    observer = PollingObserver()
+    observer = None
 
     def __init__(self, watch_folder):
         self.watch_folder = normpath(watch_folder)
         logger.info(f'Set watchFolder to {self.watch_folder}')
 
+        if use_polling:
+            self.observer = PollingObserver()
+        else:
+            self.observer = Observer()
+        logger.info(f'Using {type(self.observer).__name__}')
+
+        # Inotify reports files closed after writing (IN_CLOSE_WRITE), so files
+        # are only ready once closed or moved into place. Other backends only
+        # report their creation, the settle check then waits for the copy.
+        if InotifyObserver is not None and isinstance(self.observer, InotifyObserver):
+            ready_events = ('closed', 'moved')
+        else:
+            ready_events = ('created', 'closed', 'moved')
+
+        self.handler = Handler(ready_events)
+
     def run(self):
-        event_handler = Handler()
-        self.observer.schedule(event_handler, self.watch_folder, recursive=True)
+        self.observer.schedule(self.handler, self.watch_folder, recursive=True)
         self.observer.start()
         logger.info('Watcher started!')
 
+        # Queue files dropped while the watcher was not running, next to the
+        # files seen live
+        scanner = threading.Thread(target=self.scan)
+        scanner.daemon = True
+        scanner.start()
+
         try:
             while True:
                 time.sleep(5)
+        except (KeyboardInterrupt, SystemExit):
+            logger.info('Stopping watcher...')
+            self.observer.stop()
         except Exception as e:
             self.observer.stop()
             logger.error(f'Error: {e}')
 
         self.observer.join()
 
+        # Let in flight uploads finish, files still queued are picked up again
+        # at the next start
+        self.handler.shutdown()
+        logger.info(f'File names parsed per pattern: {filename_parser.report()}')
+        logger.info('Watcher stopped')
+
+    def scan(self):
+        logger.info("Processing any existing files...")
+        count = 0
+        folders = [self.watch_folder]
+        while folders:
+            folder = folders.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError as e:
+                logger.error(f'Could not scan {folder} due to {e}')
+                continue
+
+            for entry in entries:
+                if self.handler.ignore_regex.match(entry.path):
+                    # Do not walk files already handled
+                    continue
+
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.is_file() and self.handler.add_existing(entry):
+                    count += 1
+
+        logger.info(f"Done queuing {count} existing files")
+
     def stop(self):
         self.observer.stop()
 
@@ -108,109 +576,353 @@ class Handler(FileSystemEventHandler):
     global task_status
     global asset_type
 
-    @staticmethod
-    def on_any_event(event):
+    def __init__(self, ready_events=('created', 'closed', 'moved')):
+        super(Handler, self).__init__()
+
+        # Events after which a file is checked for settling
+        self.ready_events = ready_events
+
+        self.done_path = os.path.join(watch_folder, "done")
+        self.duplicate_path = os.path.join(watch_folder, "duplicates")
+        self.ignore_regex = re.compile(
+            "(" + re.escape(self.done_path) + "|" + re.escape(self.duplicate_path) + ").*",
+            re.IGNORECASE,
+        )
+
+        # Files waiting to settle, by path, with their last seen size and
+        # modification time and since when they have been unchanged
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self.ledger = IngestLedger(ledger_path)
+
+        # Media of batched files is encoded concurrently, each thread using
+        # its own session
+        self.encode_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=upload_workers
+        )
+
+        # Settled files are uploaded by a pool of workers, files already
+        # queued or uploading are not queued again
+        self.queue = UploadQueue(queue_size)
+        self._queued = set()
+        self._workers = []
+        for index in range(upload_workers):
+            worker = threading.Thread(
+                target=self._upload, name=f'upload-{index}'
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        settler = threading.Thread(target=self._settle)
+        settler.daemon = True
+        settler.start()
+
+    def on_any_event(self, event):
 
         if event.is_directory:
             # Do nothing for new directories
             logger.debug(f'{event.src_path} is a folder, doing nothing')
             return None
 
-        elif event.event_type == "modified":
-            # Do nothing for modified files
-            logger.debug(f'{event.src_path} has been modified, doing nothing')
+        elif event.event_type not in self.ready_events:
+            # Do nothing for modified files, the settle check stats them
+            logger.debug(f'{event.src_path} has been {event.event_type}, doing nothing')
             return None
 
-        elif event.event_type == "created":
-            # If this is a new file, process it
+        elif event.event_type == "moved":
+            # File moved into place (IN_MOVED_TO)
+            file_path = event.dest_path
+
+        else:
+            # New file, or a file closed after writing (IN_CLOSE_WRITE)
             file_path = event.src_path
-            logger.debug(f'Event created {file_path}')
-
-            done_path = os.path.join(watch_folder, "done")
-            duplicate_path = os.path.join(watch_folder, "duplicates")
-
-            if re.match(
-                re.compile(
-                    "(" + re.escape(done_path) + "|" + re.escape(duplicate_path) + ").*",
-                    re.IGNORECASE,
-                ),
-                file_path,
-            ):
-                # Ignore stuff in done or duplicates folder
-                logger.debug(f'Skipping done/dup file: {file_path}')
-                return None
+
+        logger.debug(f'Event {event.event_type} {file_path}')
+
+        if not self.is_candidate(file_path):
+            return None
+
+        with self._lock:
+            self._pending[file_path] = (get_signature(file_path), time.time())
+
+    def is_candidate(self, file_path):
+        if self.ignore_regex.match(file_path):
+            # Ignore stuff in done or duplicates folder
+            logger.debug(f'Skipping done/dup file: {file_path}')
+            return False
+
+        # Filter to movie files only
+        return bool(movie_regex.match(file_path))
+
+    def add_existing(self, entry):
+        # Queue a file found by the startup scan behind live files, return
+        # whether it was a candidate
+        if not self.is_candidate(entry.path):
+            return False
+
+        stat = entry.stat()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if check_handles or time.time() - stat.st_mtime < settle_time:
+            # Possibly still copying, let it settle as a live file
+            with self._lock:
+                self._pending[entry.path] = (signature, time.time())
+            return True
+
+        with self._lock:
+            if entry.path in self._queued:
+                return True
+            self._queued.add(entry.path)
+        self.queue.put(get_project(entry.path), entry.path, UploadQueue.BACKLOG)
+        return True
+
+    def _settle(self):
+        # Hand over files once their size and modification time have not
+        # changed for `settle_time` seconds
+        while True:
+            # Bounded below so a settle time of 0 does not spin
+            time.sleep(max(0.05, min(1, settle_time)))
+
+            settled = []
+            now = time.time()
+            with self._lock:
+                for file_path, (signature, since) in list(self._pending.items()):
+                    if file_path in self._queued:
+                        del self._pending[file_path]
+                        continue
+
+                    current = get_signature(file_path)
+                    if current is None:
+                        # Deleted or moved away before settling
+                        del self._pending[file_path]
+                    elif current != signature:
+                        self._pending[file_path] = (current, now)
+                    elif now - since >= settle_time:
+                        del self._pending[file_path]
+                        settled.append(file_path)
+
+            for file_path in settled:
+                if check_handles and has_handle(file_path):
+                    logger.debug(
+                        f'Waiting for {file_path} to finish copying...'
+                    )
+                    with self._lock:
+                        self._pending[file_path] = (get_signature(file_path), now)
+                    continue
+
+                with self._lock:
+                    self._queued.add(file_path)
+                if not self.queue.put(get_project(file_path), file_path):
+                    return
+
+    def _upload(self):
+        while True:
+            file_path = self.queue.get()
+            if file_path is None:
+                close_session()
+                return
+
+            # Group files arriving close together to commit them at once
+            file_paths = [file_path]
+            deadline = time.time() + batch_window
+            while batch_window and len(file_paths) < batch_size:
+                file_path = self.queue.get(timeout=deadline - time.time())
+                if file_path is None:
+                    break
+                file_paths.append(file_path)
 
             try:
-                # Filter to movie files only
-                if re.match(re.compile(".*\.(mov|qt|mp4)$", re.IGNORECASE), file_path):
-                    head, tail = os.path.split(file_path)
-                    try:
-                        os.makedirs(done_path)
-                        os.makedirs(duplicate_path)
-                    except:
-                        pass
-                    done_file = os.path.join(done_path, tail)
-                    duplicate_file = os.path.join(duplicate_path, tail)
-
-                    # Wait until the file has finished copying so we know for sure it's all there
-                    while has_handle(file_path):
-                        logger.debug(
-                            f'Waiting for {file_path} to finish copying...'
-                        )
-                        time.sleep(3)
-
-                    # Check if this file exists in done folder
-                    if os.path.isfile(done_file):
-                        logger.warning(
-                            f'Skipping  {file_path} as this exists in done folder. Please delete there if uploading again.'
-                        )
-
-                        # Move file to duplicate directory
-                        shutil.move(file_path, duplicate_file)
-
-                        return
-
-                    # Upload to ftrack
-                    upload_to_ftrack(file_path)
-
-                    # Move file to done directory
-                    shutil.move(file_path, done_file)
+                if len(file_paths) == 1:
+                    self.process(file_paths[0])
+                else:
+                    self.process_batch(file_paths)
+            finally:
+                with self._lock:
+                    self._queued.difference_update(file_paths)
+
+    def shutdown(self):
+        # Stop handing out files and wait for in flight uploads
+        self.queue.close()
+        for worker in self._workers:
+            worker.join()
+        self.encode_executor.shutdown()
+        close_all_sessions()
+        self.ledger.close()
+
+    def _check(self, file_path):
+        # Return the size, modification time and content hash of the file,
+        # with the id of its AssetVersion if it was uploaded already. Return
+        # None if the content was uploaded from another file, once moved to
+        # the duplicates folder.
+        try:
+            os.makedirs(self.done_path)
+            os.makedirs(self.duplicate_path)
+        except:
+            pass
+
+        size, mtime = get_signature(file_path)
+
+        # Only hash the file again if it changed since last seen
+        entry = self.ledger.get(file_path)
+        if entry and (entry['size'], entry['mtime']) == (size, mtime):
+            content_hash = entry['hash']
+        else:
+            entry = None
+            content_hash = get_file_hash(file_path)
+
+        if entry and entry['state'] == 'uploaded':
+            # Uploaded before the watcher stopped, only the move is left
+            logger.info(f'{file_path} already uploaded, moving to done folder')
+            return size, mtime, content_hash, entry['asset_version_id']
+
+        if entry and entry['state'] == 'encoded':
+            # Encoded in a batch which failed to commit, only the update of
+            # its component and task is left
+            logger.info(f'{file_path} already encoded, updating its component and task')
+            session = get_session()
+            finish_upload(session, entry['asset_version_id'], entry['component_id'])
+            session.commit()
+            self.ledger.record(
+                file_path, size, mtime, content_hash, 'uploaded', entry['asset_version_id']
+            )
+            return size, mtime, content_hash, entry['asset_version_id']
+
+        # Check if this content was uploaded already, a file only partially
+        # uploaded is retried
+        uploaded_path = self.ledger.find_uploaded(content_hash)
+        if uploaded_path is not None:
+            logger.warning(
+                f'Skipping  {file_path} as its content was uploaded from {uploaded_path}.'
+            )
+
+            # Move file to duplicate directory
+            duplicate_file = os.path.join(self.duplicate_path, os.path.basename(file_path))
+            shutil.move(file_path, duplicate_file)
+            self.ledger.record(file_path, size, mtime, content_hash, 'duplicate')
+
+            return None
+
+        return size, mtime, content_hash, None
+
+    def _done(self, file_path, size, mtime, content_hash, asset_version_id):
+        # Move file to done directory
+        done_file = os.path.join(self.done_path, os.path.basename(file_path))
+        shutil.move(file_path, done_file)
+        self.ledger.record(
+            file_path, size, mtime, content_hash, 'done', asset_version_id
+        )
+
+    def process(self, file_path):
+        try:
+            checked = self._check(file_path)
+            if checked is None:
+                return
+
+            size, mtime, content_hash, asset_version_id = checked
+            if asset_version_id is None:
+                # Upload to ftrack
+                self.ledger.record(file_path, size, mtime, content_hash, 'uploading')
+                asset_version_id = upload_to_ftrack(file_path)['id']
+                self.ledger.record(
+                    file_path, size, mtime, content_hash, 'uploaded', asset_version_id
+                )
+
+            self._done(file_path, size, mtime, content_hash, asset_version_id)
+
+        except Exception as e:
+            # raise
+            logger.error(f'Skipping {file_path} due to {e}')
+
+            # Start over with a new session rather than carrying over pending
+            # operations of the failed upload
+            close_session()
+
+    def process_batch(self, file_paths):
+        uploads = {}
+        for file_path in file_paths:
+            try:
+                checked = self._check(file_path)
+                if checked is None:
+                    continue
+
+                size, mtime, content_hash, asset_version_id = checked
+                if asset_version_id is None:
+                    self.ledger.record(file_path, size, mtime, content_hash, 'uploading')
+                    uploads[file_path] = checked
+                else:
+                    self._done(file_path, *checked)
 
             except Exception as e:
-                # raise
                 logger.error(f'Skipping {file_path} due to {e}')
 
-def upload_to_ftrack(upload_file):
-    global watch_folder
-    global task_status
+        if not uploads:
+            return
+
+        def on_encoded(file_path, asset_version_id, component_id):
+            # Recorded before the final commit, so a failed commit only
+            # updates the component and task of encoded files again
+            size, mtime, content_hash, _ = uploads[file_path]
+            self.ledger.record(
+                file_path, size, mtime, content_hash, 'encoded',
+                asset_version_id, component_id
+            )
+
+        try:
+            asset_versions = upload_batch_to_ftrack(
+                list(uploads), self.encode_executor, on_encoded
+            )
+        except Exception as e:
+            logger.error(
+                f'Could not upload batch of {len(uploads)} files due to {e}, uploading them one by one'
+            )
+            close_session()
+            for file_path in uploads:
+                self.process(file_path)
+            return
+
+        for file_path, asset_version in asset_versions.items():
+            size, mtime, content_hash, _ = uploads[file_path]
+            try:
+                self.ledger.record(
+                    file_path, size, mtime, content_hash, 'uploaded', asset_version['id']
+                )
+                self._done(file_path, size, mtime, content_hash, asset_version['id'])
+            except Exception as e:
+                logger.error(f'Skipping {file_path} due to {e}')
+
+def create_version(session, upload_file, assets=None):
+    # Find or create the task, asset and version of `upload_file` without
+    # committing. `assets` holds the assets created but not committed yet, by
+    # parent id and name.
     global asset_type
 
     file_name = os.path.basename(upload_file)
     logger.info(f"found file {file_name}")
-    # Set up ftrack connection
-    session = ftrack_api.Session()
 
     project_name = None
     shot_name = None
     task_name = None
     version = None
 
-    # Extract shot, task and version from filename using the current regex
-    rx = re.compile(default_regex, re.IGNORECASE)
-    match = rx.match(file_name)
-    if match:
-        result_dicts = match.groupdict()
-        logger.info(f"parsed {result_dicts}")
-        project_name = result_dicts.get('project')
-        shot_name = result_dicts.get('shot')
-        task_name = result_dicts.get('task')
-        version = int(result_dicts.get('version', 1))
+    # Extract shot, task and version from filename using the first matching
+    # pattern
+    pattern_name, result_dicts = filename_parser.parse(file_name)
+    logger.info(f"parsed {result_dicts} with pattern {pattern_name}")
+    project_name = result_dicts.get('project')
+    shot_name = result_dicts.get('shot')
+    task_name = result_dicts.get('task')
+    version = int(result_dicts.get('version') or 1)
+
+    task_key = (project_name, shot_name, task_name)
+    task_id = task_cache.get(task_key)
+    if task_id is not None:
+        task = session.get('Task', task_id)
     else:
-        raise ValueError(f'Could not extract value from : {file_name} with regular expression : {default_regex}')
-
+        task = session.query(f'select name, parent, project from Task where name is "{task_name}" and project.name is "{project_name}" and parent.name is "{shot_name}"').first()
+        if task:
+            task_cache.set(task_key, task['id'])
 
-    task = session.query(f'select name, parent, project from Task where name is "{task_name}" and project.name is "{project_name}" and parent.name is "{shot_name}"').first()
-    
     if not task:
         raise ValueError(f'Could not find a task named {task_name} under {project_name}/{shot_name}')
 
@@ -221,10 +933,14 @@ def upload_to_ftrack(upload_file):
     # Get asset
     assetName = re.sub(re.compile("\.(mov|qt|mp4)$", re.IGNORECASE), "", file_name)
 
-    asset= session.query(
+    asset = None
+    if assets is not None:
+        asset = assets.get((asset_parent_id, assetName))
+    if not asset:
+        asset = session.query(
             f'Asset where parent.id is "{asset_parent_id}" and name is "{assetName}"'
         ).first()
-    
+
     if not asset:
         # If asset doesn't exist, create it
         logger.debug(
@@ -232,10 +948,14 @@ def upload_to_ftrack(upload_file):
         )
 
         # Get asset type entity
-        ftrack_asset_type = session.query(f'AssetType where name is {asset_type}').one()
+        ftrack_asset_type = get_cached_entity(session, 'AssetType', f'name is "{asset_type}"')
+        if not ftrack_asset_type:
+            raise ValueError(f'Could not find asset type {asset_type}')
         asset = session.create(
             "Asset", {"name": assetName, "type": ftrack_asset_type, "parent": asset_parent}
         )
+        if assets is not None:
+            assets[(asset_parent_id, assetName)] = asset
 
     # Try getting existing assetversion
     asset_version = session.query(
@@ -248,8 +968,12 @@ def upload_to_ftrack(upload_file):
         )
         logger.debug(f'Created new assetversion: {asset_version}')
 
-        session.commit()
+    return task, assetName, asset_version
 
+
+def encode_version(upload_file, asset_version):
+    # Upload and encode the media of `upload_file`, return the id of the
+    # source component
     logger.info(f'Uploading {upload_file} to ftrack...')
 
     # Upload media
@@ -260,31 +984,108 @@ def upload_to_ftrack(upload_file):
     logger.debug(f'Job Data: {job_data}')
     logger.debug(f'Source component id {job_data["source_component_id"]}')
 
+    return job_data["source_component_id"]
+
+
+def encode_version_in_worker(upload_file, asset_version_id):
+    # Encode from an executor thread, with the session of that thread
+    session = get_session()
+    asset_version = session.get('AssetVersion', asset_version_id)
+    return encode_version(upload_file, asset_version)
+
+
+def update_uploaded(session, task, asset_name, source_component_id):
+    global task_status
+
     # Fix name on original component
-    source_component = session.get(
-        "Component", json.loads(job["data"])["source_component_id"]
-    )
-    source_component["name"] = assetName
+    source_component = session.get("Component", source_component_id)
+    source_component["name"] = asset_name
 
     # Flip task status to QC Ready
-    task_status = session.query(f'Status where name is "{task_status}"').first()
-    task["status"] = task_status
+    status = get_cached_entity(session, 'Status', f'name is "{task_status}"')
+    task["status"] = status
+
+
+def finish_upload(session, asset_version_id, source_component_id):
+    # Update the component and task of a version whose media was encoded
+    # already, without committing
+    asset_version = session.get('AssetVersion', asset_version_id)
+    update_uploaded(
+        session, asset_version['task'], asset_version['asset']['name'],
+        source_component_id
+    )
+    return asset_version
+
+
+def upload_to_ftrack(upload_file):
+    # Reuse the ftrack connection of this thread
+    session = get_session()
+
+    task, asset_name, asset_version = create_version(session, upload_file)
+    session.commit()
+
+    source_component_id = encode_version(upload_file, asset_version)
+    update_uploaded(session, task, asset_name, source_component_id)
 
     # Commit everything
     session.commit()
 
     logger.info(f'{upload_file}  uploaded to ftrack as {asset_version}')
 
-    return True
+    return asset_version
+
+
+def upload_batch_to_ftrack(upload_files, executor, on_encoded=None):
+    # Upload files arriving together, creating their assets and versions in
+    # one commit and updating their components and tasks in another. Media is
+    # encoded concurrently by `executor`, and `on_encoded` is called with each
+    # file, its AssetVersion id and source component id once encoded. Return
+    # the AssetVersion of each file uploaded, files failing to find their task
+    # or to encode are left out.
+    session = get_session()
+
+    assets = {}
+    versions = {}
+    for upload_file in upload_files:
+        try:
+            versions[upload_file] = create_version(session, upload_file, assets)
+        except Exception as e:
+            logger.error(f'Skipping {upload_file} due to {e}')
+    session.commit()
+
+    futures = [
+        executor.submit(encode_version_in_worker, upload_file, asset_version['id'])
+        for upload_file, (task, asset_name, asset_version) in versions.items()
+    ]
+
+    asset_versions = {}
+    for (upload_file, (task, asset_name, asset_version)), future in zip(
+        versions.items(), futures
+    ):
+        try:
+            source_component_id = future.result()
+        except Exception as e:
+            logger.error(f'Skipping {upload_file} due to {e}')
+            continue
+
+        if on_encoded is not None:
+            on_encoded(upload_file, asset_version['id'], source_component_id)
+        update_uploaded(session, task, asset_name, source_component_id)
+        asset_versions[upload_file] = asset_version
+
+    # Commit everything
+    session.commit()
+
+    logger.info(f'{len(asset_versions)} files uploaded to ftrack in one batch')
+
+    return asset_versions
 
 
 if __name__ == "__main__":
-    # Manually process any existing files first
-    logger.info("Processing any existing files...")
-    for file in glob.iglob(normpath(watch_folder) + "**/**", recursive=True):
-        Handler().on_any_event(FileCreatedEvent(file))
-    logger.info("Done processing existing files")
+    # Stop gracefully when terminated as a service
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-    # Create watcher for watchFolder
+    # Create watcher for watchFolder, existing files are processed in the
+    # background
     watcher = Watcher(normpath(watch_folder))
     watcher.run()